@@ -1,16 +1,94 @@
+import argparse
+import array
+import heapq
+import logging
+import mmap
+import multiprocessing
+import os
 import random
+import sqlite3
+import sys
+import threading
+import time
 
-# Creates a global dictionary to store user custom key for moves 
-# {"LEFT": None, "RIGHT": None, "UP": None, "DOWN": None}
-moves = {key: None for key in ["LEFT", "RIGHT", "UP", "DOWN"]}
-# Initiate a global list for the answer board
-answer_board = []
+try:
+    import numpy as np
+except ImportError:
+    np = None  # NumPy is only needed by the batch functions
+
+# Default key map of the functions that take a p_keys parameter, e.g. is_valid_move and solve_puzzle.
+# The game itself keeps the keys chosen by the user in its SlidingPuzzle engine.
+DEFAULT_KEYS = {"LEFT": "a", "RIGHT": "d", "UP": "w", "DOWN": "s"}
+
+# Directions of the blank tile for each move, in the order used by the solver.
+# A "LEFT" move slides the tile on the right of the blank to the left, so the blank goes right, etc.
+# Direction indices are paired so that (d ^ 1) is the opposite of direction d.
+DIRECTIONS = ("LEFT", "RIGHT", "UP", "DOWN")
+
+# Directory of the pattern database files used by the solver
+PDB_DIR = "pdb"
+# Disjoint tile partitions of the pattern databases for each board dimension
+PDB_PARTITIONS = {
+    4: ((1, 5, 6, 9, 10, 13), (7, 8, 11, 12, 14, 15), (2, 3, 4)),
+}
+# Pattern databases mapped into memory so far, {dim: [(pattern, table), ...]}
+pattern_databases = {}
+# File of the optimal distance of every 8-puzzle state, indexed by permutation rank
+DISTANCE_TABLE_PATH = os.path.join(PDB_DIR, "distance_3x3.bin")
+# The 8-puzzle distance table once loaded
+distance_table = None
+# Ranks of the 8-puzzle states grouped by optimal distance, built from the distance table
+distance_index = None
+# Largest optimal solution length of each board dimension
+MAX_DISTANCE = {3: 31, 4: 80}
+# Random walks for puzzles of a given difficulty restart after this many times the wanted length
+RANDOM_WALK_LIMIT = 10
+# Random walks give up after this many restarts
+RANDOM_WALK_RESTARTS = 100
+# Longest solution length of a 4x4 puzzle that is made quickly, with and without the pattern databases.
+# Random walks seldom get further, and solving the board to trim it gets slow beyond.
+DIFFICULTY_LIMIT_PDB = 50
+DIFFICULTY_LIMIT_MD_LC = 25
+
+# Largest board dimension of the game
+MAX_DIM = 10
+# Heuristic weight of the bounded-suboptimal solver used for boards bigger than 4x4
+BOUNDED_WEIGHT = 3
+# Most search states the bounded-suboptimal solver keeps in memory at once
+BOUNDED_MAX_NODES = 200000
+# Heuristic weight the bounded-suboptimal solver switches to when its time budget is used up
+GREEDY_WEIGHT = 20
+# Number of tiles of a row or column the bounded-suboptimal solver adds in each stage
+STAGE_TILES = 4
+
+# Seed of the Zobrist keys, fixed so board hashes are the same in every session
+ZOBRIST_SEED = 1002
+# Zobrist keys by dimension, see get_zobrist_table
+zobrist_tables = {}
+
+# File of the solution cache shared by all sessions
+SOLUTION_CACHE_PATH = "solutions.sqlite"
+# Most solutions kept in the cache; the least recently used ones are dropped beyond this
+SOLUTION_CACHE_SIZE = 10000
+# The solution cache once opened
+solution_cache = None
+
+# Key that asks for a hint during the game; it is not a letter, so it never clashes with the move keys
+HINT_KEY = "?"
+# Longest time in seconds a hint request waits for the background search
+HINT_LATENCY = 0.2
+# Longest time in seconds a background hint search may run
+HINT_TIME_BUDGET = 30
+# File where hint latencies are logged during the game
+HINT_LOG_FILE = "hints.log"
+
+logger = logging.getLogger(__name__)
 
 
 def prompt_assign_keys():
-    # Asks user for custom keys for moves and assigns them to the moves dictionary.
+    # Asks user for custom keys for moves.
     #
-    # return: None
+    # return: dictionary of the key of each move, e.g. {"LEFT": "a", "RIGHT": "d", "UP": "w", "DOWN": "s"}
 
     # Repeat until the user input is valid
     while True:
@@ -80,42 +158,102 @@ def prompt_assign_keys():
                 continue
     
     # Assign each letter to corresponding move.
+    keys = {}
     index = 0
     for key in ["LEFT", "RIGHT", "UP", "DOWN"]:
-        moves[key] = keys_list[index]
+        keys[key] = keys_list[index]
         index += 1
 
+    return keys
+
 
 def prompt_dim_or_end():
     # Asks user input for the choice of board dimension or quit game and returns the choice.
     #
-    # return: string containing the choice, either "1", "2", or "q"
+    # return: string containing the choice, either "1", "2", a dimension from "5" to MAX_DIM, or "q"
+
+    choices = ["1", "2", "q"] + [str(dim) for dim in range(5, MAX_DIM + 1)]
+    message = f'Invalid input. Please enter either "1", "2", a size from 5 to {MAX_DIM}, or "q" only.'
 
     # Repeat until user input is valid
     while True:
         try:
-            choice = input('Enter "1" for 8-puzzle, "2" for 15-puzzle, or "q" to end the game > ')
+            choice = input(f'Enter "1" for 8-puzzle, "2" for 15-puzzle, a size from 5 to {MAX_DIM} '
+                           'for a bigger puzzle, or "q" to end the game > ')
             choice = choice.lower()  # Lowercase the string input to be case-insensitive
             choice = choice.strip()  # Remove leading and trailing whitespaces
-            if choice not in ("1", "2", "q"):
-                # Warn user if the input is other than "1", "2", or "q" and ask again.
-                print('Invalid input. Please enter either "1", "2", or "q" only.')
+            if choice not in choices:
+                # Warn user if the input is not one of the choices and ask again.
+                print(message)
                 continue
         except Exception:
             # Warn user if the input produces any kind of error and ask again.
-            print('Invalid input. Please enter either "1", "2", or "q" only.')
+            print(message)
         else:
             break
 
     return choice
 
 
+def prompt_difficulty(p_dim):
+    # Asks user for the number of moves needed to solve the new puzzle.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: (min, max) tuple of solution lengths, or None for a puzzle of random difficulty
+
+    limit = get_difficulty_limit(p_dim)
+    message = f"Invalid input. Please enter a number or a range such as 10-20, between 1 and {limit}."
+    if p_dim > 3 and limit < DIFFICULTY_LIMIT_PDB:
+        print(f"Puzzles of up to {limit} moves are available. "
+              f"Build the pattern databases with --build-pdb for up to {DIFFICULTY_LIMIT_PDB} moves.")
+
+    # Repeat until user input is valid
+    while True:
+        try:
+            choice = input("Enter the number of moves to solve the puzzle (e.g. 10 or 10-20), "
+                           "or press Enter for a random puzzle > ")
+            choice = choice.strip()  # Remove leading and trailing whitespaces
+            if choice == "":
+                return None
+            parts = choice.split("-")
+            low = int(parts[0])
+            high = int(parts[-1])
+            if len(parts) > 2 or low < 1 or high < low or high > limit:
+                # Warn user if the range is not possible and ask again.
+                print(message)
+                continue
+        except Exception:
+            # Warn user if the input produces any kind of error and ask again.
+            print(message)
+        else:
+            break
+
+    return (low, high)
+
+
+def get_difficulty_limit(p_dim):
+    # Returns the longest solution length get_puzzle_by_distance can reach in reasonable time.
+    #
+    # param p_dim (int): the dimension of the board, 3 or 4
+    # return: an integer
+
+    if p_dim == 3:
+        return MAX_DISTANCE[3]  # Every 8-puzzle state is in the distance table
+    if load_pattern_databases(p_dim) is None:
+        return DIFFICULTY_LIMIT_MD_LC
+
+    return DIFFICULTY_LIMIT_PDB
+
+
 def get_blank_pos(p_board):
     # Returns the position of the blank tile.
     #
-    # param p_board (list): the game board  
+    # param p_board (list or PackedBoard): the game board
     # return: (y, x) tuple where the blank tile is in the y-th row and x-th column
 
+    if isinstance(p_board, PackedBoard):
+        return divmod(p_board.blank, p_board.dim)  # The packed board caches the blank index
+
     dim = len(p_board)
     # Go through each element and find the element containing 0 which is the blank tile.
     for y in range(dim):
@@ -124,82 +262,76 @@ def get_blank_pos(p_board):
                 return (y, x)
 
 
-def is_valid_move(p_board, p_move):
+def is_valid_move(p_board, p_move, p_keys=DEFAULT_KEYS):
     # Checks whether the move given is a valid move in the given board.
     #
-    # param p_board (list): the game board
+    # param p_board (list or PackedBoard): the game board
     # param p_move (str): the move to be checked
+    # param p_keys (dict): the key of each move, see DEFAULT_KEYS
     # return: Boolean (True if the move is valid, False if the move is invalid)
 
+    if isinstance(p_board, PackedBoard):
+        direction = get_move_direction(p_move, p_keys)
+        return direction < 0 or p_board.can_move(direction)
+
     blank_y, blank_x = get_blank_pos(p_board)  # Get the index position of the blank tile
-    if p_move == moves["LEFT"] and blank_x == len(p_board[0]) - 1:
+    if p_move == p_keys["LEFT"] and blank_x == len(p_board[0]) - 1:
         return False  # Left move is not available if the blank tile is at the right-most column
-    elif p_move == moves["RIGHT"] and blank_x == 0:
+    elif p_move == p_keys["RIGHT"] and blank_x == 0:
         return False  # Right move is not available if the blank tile is at the left-most column
-    elif p_move == moves["UP"] and blank_y == len(p_board) - 1:
+    elif p_move == p_keys["UP"] and blank_y == len(p_board) - 1:
         return False  # Up move is not available if the blank tile is at the bottom-most row
-    elif p_move == moves["DOWN"] and blank_y == 0:
+    elif p_move == p_keys["DOWN"] and blank_y == 0:
         return False  # Down move is not available if the blank tile is at the top-most row
     else:
         return True
 
 
-def valid_moves_prompt(p_board):
+def valid_moves_prompt(p_game):
     # Generates the prompt for the user input for the next move.
     #
-    # param p_board (list): the game board
-    # return: string containing the prompt, e.g. "Enter your move (left-a, right-d, up-w, down-s) > "
-
-    # Create a string of the choices of possible moves.
-    prompt = "Enter your move ("
-    num = 0
-    if is_valid_move(p_board, moves["LEFT"]):
-        prompt += f"left-{moves['LEFT']}"
-        num += 1
-    if is_valid_move(p_board, moves["RIGHT"]):
-        if num > 0:
-            prompt += ", "  # Add comma in between if there are more than one possible moves
-        prompt += f"right-{moves['RIGHT']}"
-        num += 1
-    if is_valid_move(p_board, moves["UP"]):
-        if num > 0:
-            prompt += ", "
-        prompt += f"up-{moves['UP']}"
-        num += 1
-    if is_valid_move(p_board, moves["DOWN"]):
-        if num > 0:
-            prompt += ", "
-        prompt += f"down-{moves['DOWN']}"
-        num += 1
-    prompt += ") > "
-
-    return prompt
-
-
-def prompt_moves(p_board):
-    # Asks user input for the next move.
-    #
-    # param p_board (list): the game board
-    # return: string containing the letter corresponding to a move
+    # param p_game (SlidingPuzzle): the game
+    # return: string containing the prompt, e.g. "Enter your move (left-a, right-d, up-w, down-s, hint-?) > "
+
+    # Create a string of the choices of possible moves, separated by commas.
+    legal = p_game.legal_moves()
+    choices = []
+    for name in DIRECTIONS:
+        key = p_game.keys[name]
+        if key in legal:
+            choices.append(f"{name.lower()}-{key}")
 
-    prompt = valid_moves_prompt(p_board)  # Get the prompt containing valid moves for current board
-    keys = []
+    choices.append(f"hint-{HINT_KEY}")
 
-    # Get a list of keys of valid moves.
-    for move in moves.values():
-        if is_valid_move(p_board, move):
-            keys.append(move)
+    return "Enter your move (" + ", ".join(choices) + ") > "
+
+
+def prompt_moves(p_game):
+    # Asks user input for the next moves. A whole string of moves such as "wwasdd" may be entered;
+    # it is accepted only if every move in it is available when the moves are done in order.
+    #
+    # param p_game (SlidingPuzzle): the game
+    # return: string containing the letters corresponding to the moves, or HINT_KEY
+
+    prompt = valid_moves_prompt(p_game)  # Get the prompt containing valid moves for current board
 
     # Repeat until user input is valid.
     while True:
         try:
-            move = input(prompt)  # Asks user for a move
+            move = input(prompt)  # Asks user for moves
             move = move.lower()  # Lowercase the string input to be case-insensitive
-            move = move.strip()  # Remove leading and trailing whitespaces
-            if move not in keys:
+            move = "".join(move.split())  # Remove all whitespaces
+            if move == HINT_KEY:
+                break
+            position = p_game.find_invalid_move(move) if move else 0
+            if position == 0 and len(move) <= 1:
                 # Warn user if the move is not among the choices of valid moves and ask again.
                 print("Invalid input. The move is not available. Please enter again.")
                 continue
+            if position >= 0:
+                # Warn user about the first move of the string that cannot be done and ask again.
+                print(f"Invalid input. Move {position + 1} ({move[position]}) is not available. Please enter again.")
+                continue
         except Exception:
             # Warn user if the input produces any kind of error and ask again.
             print("Invalid input. Please enter again.")
@@ -240,19 +372,29 @@ def get_new_puzzle(p_dim):
     # param p_dim (int): the dimension for the board
     # return: a list which is a random game board, e.g. [[2, 0, 6], [4, 8, 3], [5, 1, 7]]
 
-    board = []  # Initiates a list for the game board
     elements = list(range(1, p_dim*p_dim)) + [0]  # Initiates a list [1, ..., p_dim*p_dim, 0]
-    
-    # Make the board which is a list consisting of p_dim amount of row lists.
-    for _ in range(p_dim):
-        row = []
-        # Make a list for each row, consisting of p_dim amount of random element from elements list.
-        for _ in range(p_dim):
-            element = random.choice(elements)
-            row.append(element)
-            elements.remove(element)  # Remove appended element from the elements list so it won't be chosen again
-        board.append(row)
-    
+    random.shuffle(elements)  # Shuffle all elements in one O(n) pass
+
+    # Cut the shuffled elements into p_dim rows of p_dim elements.
+    return [elements[i*p_dim:(i+1)*p_dim] for i in range(p_dim)]
+
+
+def get_solvable_puzzle(p_dim):
+    # Generates a uniformly random solvable game board without retrying.
+    # Swapping two tiles flips the parity of the inversions, which turns an unsolvable board
+    # into a solvable one. The swapped cells only depend on where the blank is, so this pairs
+    # unsolvable and solvable boards one to one and keeps the result uniform.
+    #
+    # param p_dim (int): the dimension for the board
+    # return: a list which is a random solvable game board
+
+    board = get_new_puzzle(p_dim)
+    if not is_solvable(board):
+        # Swap the tiles in the first two cells that do not hold the blank.
+        cells = [(i // p_dim, i % p_dim) for i in range(3) if board[i // p_dim][i % p_dim] != 0][:2]
+        (y1, x1), (y2, x2) = cells
+        board[y1][x1], board[y2][x2] = board[y2][x2], board[y1][x1]
+
     return board
 
 
@@ -276,17 +418,36 @@ def nested_to_linear_list(p_list):
 
 def count_inv(p_list):
     # An inversion is any pair of tiles i and j where i < j but i appears after j.
+    # The blank (0) is ignored. Inversions are counted while merge sorting the tiles, in O(n log n).
     #
     # param p_list (list): the list to be calculated
     # return: an integer (number of inversions)
 
+    tiles = [tile for tile in p_list if tile != 0]
+    buffer = tiles[:]
     inversions = 0
-    length = len(p_list)
-    for i in range(length-1):
-        for j in range(i, length):
-            if p_list[i] != 0 and p_list[j] != 0 and p_list[i] > p_list[j]:
-                inversions += 1
-    
+    length = len(tiles)
+
+    # Bottom-up merge sort: merge neighbouring runs of width 1, 2, 4, ...
+    width = 1
+    while width < length:
+        for low in range(0, length - width, 2 * width):
+            mid = low + width
+            high = min(low + 2 * width, length)
+            i, j, k = low, mid, low
+            while i < mid and j < high:
+                if tiles[i] <= tiles[j]:
+                    buffer[k] = tiles[i]
+                    i += 1
+                else:
+                    buffer[k] = tiles[j]
+                    j += 1
+                    inversions += mid - i  # tiles[j] is smaller than every tile left in the first run
+                k += 1
+            buffer[k:high] = tiles[i:mid] if i < mid else tiles[j:high]
+            tiles[low:high] = buffer[low:high]
+        width *= 2
+
     return inversions
 
 
@@ -326,75 +487,1722 @@ def is_solvable(p_board):
             return False
 
 
-def move_tile(p_board, p_move):
+def move_tile(p_board, p_move, p_hash=None, p_keys=DEFAULT_KEYS):
     # Moves the tile on the board based on the move given by user.
+    # If the Zobrist hash of the board is given, it is updated in O(1) and returned.
     #
-    # param p_board (list): the game board
+    # param p_board (list or PackedBoard): the game board
     # param p_move (str): the letter user inputted corresponding to a move
-    # return: None
+    # param p_hash (int): optional, the Zobrist hash of p_board (see zobrist_hash)
+    # param p_keys (dict): the key of each move, see DEFAULT_KEYS
+    # return: the new hash if p_hash is given, otherwise None
+
+    if isinstance(p_board, PackedBoard):
+        direction = get_move_direction(p_move, p_keys)
+        if direction >= 0:
+            p_board.move(direction)  # The packed board keeps its own hash up to date
+        return None if p_hash is None else p_board.hash
 
     blank_y, blank_x = get_blank_pos(p_board)  # Get the index position of the blank tile (y-th row, x-th column)
-    if is_valid_move(p_board, p_move):
-        if p_move == moves["LEFT"]:
-            # If move is left, swap the blank tile with the element on the right
-            p_board[blank_y][blank_x] = p_board[blank_y][blank_x + 1]
-            p_board[blank_y][blank_x + 1] = 0 
-        elif p_move == moves["RIGHT"]:
-            # If move is right, swap the blank tile with the element on the left
-            p_board[blank_y][blank_x] = p_board[blank_y][blank_x - 1]
-            p_board[blank_y][blank_x - 1] = 0
-        elif p_move == moves["UP"]:
-            # If move is up, swap the blank tile with the element below it
-            p_board[blank_y][blank_x] = p_board[blank_y + 1][blank_x]
-            p_board[blank_y + 1][blank_x] = 0
-        elif p_move == moves["DOWN"]:
-            # If move is down, swap the blank tile with the element on top of it
-            p_board[blank_y][blank_x] = p_board[blank_y - 1][blank_x]
-            p_board[blank_y - 1][blank_x] = 0
-
-
-def check_board(p_board):
+    if not is_valid_move(p_board, p_move, p_keys):
+        return p_hash
+
+    if p_move == p_keys["LEFT"]:
+        tile_y, tile_x = blank_y, blank_x + 1  # If move is left, swap the blank tile with the element on the right
+    elif p_move == p_keys["RIGHT"]:
+        tile_y, tile_x = blank_y, blank_x - 1  # If move is right, swap the blank tile with the element on the left
+    elif p_move == p_keys["UP"]:
+        tile_y, tile_x = blank_y + 1, blank_x  # If move is up, swap the blank tile with the element below it
+    else:
+        tile_y, tile_x = blank_y - 1, blank_x  # If move is down, swap the blank tile with the element on top of it
+
+    tile = p_board[tile_y][tile_x]
+    p_board[blank_y][blank_x] = tile
+    p_board[tile_y][tile_x] = 0
+
+    if p_hash is None:
+        return None
+    dim = len(p_board)
+    return update_zobrist_hash(p_hash, dim, tile, tile_y*dim + tile_x, blank_y*dim + blank_x)
+
+
+def get_zobrist_table(p_dim):
+    # Returns the Zobrist keys of a dimension, table[index][tile], creating them on first use.
+    # The keys come from a fixed seed, so hashes stay the same across sessions and processes.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a list of lists of 63-bit integers
+
+    if p_dim not in zobrist_tables:
+        generator = random.Random(ZOBRIST_SEED + p_dim)
+        size = p_dim * p_dim
+        zobrist_tables[p_dim] = [[generator.getrandbits(63) for _ in range(size)] for _ in range(size)]
+    return zobrist_tables[p_dim]
+
+
+def zobrist_hash(p_board):
+    # Computes the Zobrist hash of a board, the XOR of the key of every (cell, tile) pair.
+    #
+    # param p_board (list): the game board
+    # return: a 63-bit integer
+
+    table = get_zobrist_table(len(p_board))
+    value = 0
+    for index, tile in enumerate(nested_to_linear_list(p_board)):
+        value ^= table[index][tile]
+
+    return value
+
+
+def update_zobrist_hash(p_hash, p_dim, p_tile, p_src, p_dst):
+    # Updates a Zobrist hash after a tile slid from p_src into the blank on p_dst.
+    #
+    # param p_hash (int): the hash before the move
+    # param p_dim (int): the dimension of the board
+    # param p_tile (int): the moved tile
+    # param p_src (int): the flattened index the tile left, where the blank is now
+    # param p_dst (int): the flattened index the tile moved to, where the blank was
+    # return: the hash after the move
+
+    table = get_zobrist_table(p_dim)
+    return p_hash ^ table[p_src][p_tile] ^ table[p_dst][p_tile] ^ table[p_src][0] ^ table[p_dst][0]
+
+
+def check_board(p_board, p_hash=None):
     # Checks if the current state of the board is equal to the answer board, i.e. solved.
+    # With the Zobrist hash of the board, or a packed board, the check costs O(1).
     #
-    # param p_board (list): the game board to be checked
+    # param p_board (list or PackedBoard): the game board to be checked
+    # param p_hash (int): optional, the Zobrist hash of p_board
     # return: Boolean (True if the board is solved, False if the board is not yet solved)
 
-    return p_board == answer_board
+    if isinstance(p_board, PackedBoard):
+        return p_board.is_solved()
+    if p_hash is not None:
+        return p_hash == get_goal_hash(len(p_board))
 
+    return p_board == get_initial_board(len(p_board))
 
-def print_board(p_board):
-    # Prints the game board, e.g.
+
+class PackedBoard:
+    # A game board packed into a single integer, with the tile at flattened index i stored
+    # in bits [i*bits, (i+1)*bits). Boards up to 4x4 use 4 bits per tile, larger boards use 8.
+    # The index of the blank tile and the Zobrist hash are kept up to date, so moves, move checks
+    # and the solved check cost O(1).
+
+    __slots__ = ("dim", "bits", "state", "blank", "hash", "moves_table", "zobrist")
+
+    # Move tables by dimension: table[index][direction] is the new blank index, or -1 if the move is invalid
+    move_tables = {}
+
+    def __init__(self, p_dim, p_state, p_blank, p_hash=None):
+        # param p_dim (int): the dimension of the board
+        # param p_state (int): the packed tiles
+        # param p_blank (int): the flattened index of the blank tile
+        # param p_hash (int): the Zobrist hash of the board, computed if not given
+        self.dim = p_dim
+        self.bits = 4 if p_dim * p_dim <= 16 else 8
+        self.state = p_state
+        self.blank = p_blank
+        self.moves_table = PackedBoard.get_move_table(p_dim)
+        self.zobrist = get_zobrist_table(p_dim)
+        if p_hash is None:
+            p_hash = 0
+            for index, tile in enumerate(self.to_list()):
+                p_hash ^= self.zobrist[index][tile]
+        self.hash = p_hash
+
+    def copy(self):
+        # Returns an independent copy of the board.
+        return PackedBoard(self.dim, self.state, self.blank, self.hash)
+
+    @staticmethod
+    def get_move_table(p_dim):
+        # Returns the move table of a dimension, computing it on first use.
+        if p_dim not in PackedBoard.move_tables:
+            table = []
+            for neighbors in get_neighbor_table(p_dim):
+                row = [-1] * len(DIRECTIONS)
+                for direction, target in neighbors:
+                    row[direction] = target
+                table.append(row)
+            PackedBoard.move_tables[p_dim] = table
+        return PackedBoard.move_tables[p_dim]
+
+    def tile_at(self, p_index):
+        # Returns the tile at a flattened index.
+        return (self.state >> (p_index * self.bits)) & ((1 << self.bits) - 1)
+
+    def can_move(self, p_direction):
+        # Checks whether the blank can move in a direction (index into DIRECTIONS).
+        return self.moves_table[self.blank][p_direction] >= 0
+
+    def move(self, p_direction):
+        # Moves the blank in a direction (index into DIRECTIONS) by swapping two tile fields.
+        # Returns False and leaves the board unchanged if the move is invalid.
+        target = self.moves_table[self.blank][p_direction]
+        if target < 0:
+            return False
+        shift = target * self.bits
+        tile = (self.state >> shift) & ((1 << self.bits) - 1)
+        # The blank field is 0, so the tile only has to be cleared from target and set on blank.
+        self.state ^= (tile << shift) | (tile << (self.blank * self.bits))
+        source = self.zobrist[target]
+        destination = self.zobrist[self.blank]
+        self.hash ^= source[tile] ^ destination[tile] ^ source[0] ^ destination[0]
+        self.blank = target
+        return True
+
+    def is_solved(self):
+        # Checks whether the board is in the goal order, by its hash.
+        return self.hash == get_goal_hash(self.dim)
+
+    def to_list(self):
+        # Returns the tiles as a flat list.
+        return [self.tile_at(i) for i in range(self.dim * self.dim)]
+
+
+class SlidingPuzzle:
+    # Headless sliding puzzle engine: holds the board, the key map and the step count.
+    # It does no input or output, so bots, replays and benchmarks can drive it directly.
+
+    def __init__(self, p_board, p_keys):
+        # param p_board (list or PackedBoard): the starting board, it is copied
+        # param p_keys (dict): the key of each move, e.g. {"LEFT": "a", "RIGHT": "d", "UP": "w", "DOWN": "s"}
+        if isinstance(p_board, PackedBoard):
+            self.board = p_board.copy()
+        else:
+            self.board = pack_board(p_board)
+        self.dim = self.board.dim
+        self.keys = dict(p_keys)
+        self.directions = {p_keys[name]: direction for direction, name in enumerate(DIRECTIONS)}
+        self.steps = 0
+
+    @classmethod
+    def new_game(cls, p_dim, p_keys):
+        # Creates a game on a random solvable board of a dimension.
+        return cls(get_solvable_puzzle(p_dim), p_keys)
+
+    def apply_move(self, p_key):
+        # Applies the move of a key. Returns False and counts no step if the move is not available.
+        direction = self.directions.get(p_key)
+        if direction is None or not self.board.move(direction):
+            return False
+        self.steps += 1
+        return True
+
+    def apply_direction(self, p_direction):
+        # Applies a move by direction index (into DIRECTIONS), for callers that skip the key map.
+        if not self.board.move(p_direction):
+            return False
+        self.steps += 1
+        return True
+
+    def find_invalid_move(self, p_keys):
+        # Returns the position of the first key in p_keys that is not an available move when
+        # the keys are done in order, or -1 if all of them are. The board is not changed.
+        board = self.board.copy()
+        directions = self.directions
+        for position, key in enumerate(p_keys):
+            direction = directions.get(key)
+            if direction is None or not board.move(direction):
+                return position
+        return -1
+
+    def apply_moves(self, p_keys):
+        # Applies a string of move keys as one batch. If any of them is not available,
+        # nothing is applied and False is returned.
+        board = self.board.copy()
+        directions = self.directions
+        for key in p_keys:
+            direction = directions.get(key)
+            if direction is None or not board.move(direction):
+                return False
+        self.board = board
+        self.steps += len(p_keys)
+        return True
+
+    def legal_moves(self):
+        # Returns the keys of the available moves, in LEFT, RIGHT, UP, DOWN order.
+        board = self.board
+        return [self.keys[name] for direction, name in enumerate(DIRECTIONS) if board.can_move(direction)]
+
+    def is_solved(self):
+        # Checks whether the board is solved.
+        return self.board.is_solved()
+
+    def get_board(self):
+        # Returns the current board as a nested list.
+        return unpack_board(self.board)
+
+
+# Zobrist hashes of the answer boards by dimension
+goal_hashes = {}
+
+
+def get_goal_hash(p_dim):
+    # Returns the Zobrist hash of the answer board of a dimension.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a 63-bit integer
+
+    if p_dim not in goal_hashes:
+        goal_hashes[p_dim] = zobrist_hash(get_initial_board(p_dim))
+    return goal_hashes[p_dim]
+
+
+def pack_board(p_board):
+    # Converts a nested list board into a PackedBoard.
+    #
+    # param p_board (list): the game board, e.g. [[1, 2, 3], [4, 5, 6], [7, 8, 0]]
+    # return: a PackedBoard with the same tiles
+
+    dim = len(p_board)
+    bits = 4 if dim * dim <= 16 else 8
+    state = 0
+    blank = 0
+    for index, tile in enumerate(nested_to_linear_list(p_board)):
+        state |= tile << (index * bits)
+        if tile == 0:
+            blank = index
+
+    return PackedBoard(dim, state, blank)
+
+
+def unpack_board(p_packed):
+    # Converts a PackedBoard into a nested list board.
+    #
+    # param p_packed (PackedBoard): the packed board
+    # return: a list which is the game board
+
+    tiles = p_packed.to_list()
+    dim = p_packed.dim
+    return [tiles[i*dim:(i+1)*dim] for i in range(dim)]
+
+
+def get_move_direction(p_move, p_keys=DEFAULT_KEYS):
+    # Returns the direction index of a move key, or -1 if the key is not assigned to any move.
+    #
+    # param p_move (str): the letter corresponding to a move
+    # param p_keys (dict): the key of each move, see DEFAULT_KEYS
+    # return: an integer index into DIRECTIONS
+
+    for direction, name in enumerate(DIRECTIONS):
+        if p_keys[name] == p_move:
+            return direction
+    return -1
+
+
+def get_neighbor_table(p_dim):
+    # Precomputes where the blank tile goes for every move from every cell of a flattened board.
+    # Cell (y, x) of the board is index y*p_dim + x in the flattened board.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a list of p_dim*p_dim lists of (direction index, new blank index) tuples
+
+    table = []
+    for index in range(p_dim * p_dim):
+        y, x = divmod(index, p_dim)
+        neighbors = []
+        if x < p_dim - 1:
+            neighbors.append((0, index + 1))  # LEFT: blank swaps with the tile on its right
+        if x > 0:
+            neighbors.append((1, index - 1))  # RIGHT: blank swaps with the tile on its left
+        if y < p_dim - 1:
+            neighbors.append((2, index + p_dim))  # UP: blank swaps with the tile below it
+        if y > 0:
+            neighbors.append((3, index - p_dim))  # DOWN: blank swaps with the tile above it
+        table.append(neighbors)
+
+    return table
+
+
+def get_manhattan_table(p_dim):
+    # Precomputes the Manhattan distance of every tile from every cell to its goal cell.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a list where table[tile][index] is the distance of tile at flattened index to its goal
+
+    size = p_dim * p_dim
+    table = [[0] * size]  # The blank tile does not count
+    for tile in range(1, size):
+        goal_y, goal_x = divmod(tile - 1, p_dim)
+        row = []
+        for index in range(size):
+            y, x = divmod(index, p_dim)
+            row.append(abs(y - goal_y) + abs(x - goal_x))
+        table.append(row)
+
+    return table
+
+
+def count_line_conflicts(p_goals):
+    # Counts the linear conflicts in one row or column.
+    # p_goals holds, in their current order, the goal offsets within the line of the tiles that belong to it.
+    # The number of tiles that must leave the line is the count of tiles outside the
+    # longest increasing subsequence; each of them costs at least two extra moves.
+    #
+    # param p_goals (tuple): goal offsets of the tiles in the line
+    # return: an integer (extra moves needed on top of the Manhattan distance)
+
+    # Longest increasing subsequence by patience sorting.
+    piles = []
+    for goal in p_goals:
+        low, high = 0, len(piles)
+        while low < high:
+            mid = (low + high) // 2
+            if piles[mid] < goal:
+                low = mid + 1
+            else:
+                high = mid
+        if low == len(piles):
+            piles.append(goal)
+        else:
+            piles[low] = goal
+
+    return 2 * (len(p_goals) - len(piles))
+
+
+def make_md_lc_heuristic(p_tiles, p_dim):
+    # Builds the Manhattan distance plus linear conflict heuristic for a flattened board.
+    # Only the goal line of the moved tile is re-evaluated, and only when the tile enters or leaves it.
+    #
+    # param p_tiles (list): the flattened board, which the returned update function reads
+    # param p_dim (int): the dimension of the board
+    # return: (h, update) where h is the heuristic value of p_tiles and
+    #         update(tile, src, dst) returns the new value after tile moved from src to dst
+
+    manhattan = get_manhattan_table(p_dim)
+    cache = {}  # Conflicts of a line by its goal offsets
+
+    def row_conflicts(row):
+        goals = tuple((tile - 1) % p_dim for tile in p_tiles[row*p_dim:(row+1)*p_dim]
+                      if tile and (tile - 1) // p_dim == row)
+        if goals not in cache:
+            cache[goals] = count_line_conflicts(goals)
+        return cache[goals]
+
+    def col_conflicts(col):
+        goals = tuple((tile - 1) // p_dim for tile in p_tiles[col::p_dim]
+                      if tile and (tile - 1) % p_dim == col)
+        if goals not in cache:
+            cache[goals] = count_line_conflicts(goals)
+        return cache[goals]
+
+    rows = [row_conflicts(i) for i in range(p_dim)]
+    cols = [col_conflicts(i) for i in range(p_dim)]
+    state = [sum(manhattan[tile][i] for i, tile in enumerate(p_tiles)) + sum(rows) + sum(cols)]
+
+    def update(tile, src, dst):
+        h = state[0] + manhattan[tile][dst] - manhattan[tile][src]
+        goal_y, goal_x = divmod(tile - 1, p_dim)
+        src_y, src_x = divmod(src, p_dim)
+        dst_y, dst_x = divmod(dst, p_dim)
+        # A line only changes if the moved tile belongs to it, i.e. enters or leaves its goal line.
+        if src_y == dst_y:
+            # Horizontal move: the order inside the row is unchanged, only a column can change.
+            if src_x == goal_x or dst_x == goal_x:
+                h -= cols[goal_x]
+                cols[goal_x] = col_conflicts(goal_x)
+                h += cols[goal_x]
+        elif src_y == goal_y or dst_y == goal_y:
+            # Vertical move: only the goal row of the tile can change.
+            h -= rows[goal_y]
+            rows[goal_y] = row_conflicts(goal_y)
+            h += rows[goal_y]
+        state[0] = h
+        return h
+
+    return state[0], update
+
+
+def get_pattern_weights(p_dim, p_pattern):
+    # Gets the weight of each tile of a pattern in the index of a pattern database.
+    # The index of a placement is the sum of position*weight over the pattern tiles,
+    # i.e. the positions written as digits in base p_dim*p_dim.
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_pattern (tuple): the tiles in the pattern, e.g. (1, 2, 3, 5, 6)
+    # return: a list of weights, one for each tile of the pattern
+
+    size = p_dim * p_dim
+    return [size ** slot for slot in range(len(p_pattern))]
+
+
+def get_pdb_path(p_dim, p_pattern):
+    # Gets the file path of a pattern database, e.g. "pdb/pdb_4x4_1-2-3-5-6.bin".
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_pattern (tuple): the tiles in the pattern
+    # return: string containing the path
+
+    name = "-".join(str(tile) for tile in p_pattern)
+    return os.path.join(PDB_DIR, f"pdb_{p_dim}x{p_dim}_{name}.bin")
+
+
+def build_pattern_database(p_dim, p_pattern):
+    # Computes a pattern database by retrograde breadth-first search from the goal.
+    # Only moves of pattern tiles are counted, so databases of disjoint patterns can be added together.
+    # The search works on (placement, blank region) states: the blank moves for free through
+    # the cells not taken by pattern tiles, and every pattern tile next to that region can slide into it.
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_pattern (tuple): the tiles in the pattern
+    # return: a bytearray where table[index] is the number of pattern moves needed to
+    #         bring the placement with that index home (255 for impossible placements)
+
+    size = p_dim * p_dim
+    num = len(p_pattern)
+    weights = get_pattern_weights(p_dim, p_pattern)
+    neighbors = [[cell for _, cell in cells] for cells in get_neighbor_table(p_dim)]
+    table = bytearray(b"\xff") * (size ** num)
+    visited = bytearray(size ** num * size // 8 + 1)  # One bit for each (placement, blank cell)
+
+    def decode(index):
+        # Returns a dictionary {position: slot} of the pattern tiles.
+        occupied = {}
+        for slot in range(num):
+            occupied[index // weights[slot] % size] = slot
+        return occupied
+
+    def get_region(occupied, blank):
+        # Returns the cells the blank can reach without moving any pattern tile.
+        region = [blank]
+        seen = {blank}
+        for cell in region:
+            for other in neighbors[cell]:
+                if other not in occupied and other not in seen:
+                    seen.add(other)
+                    region.append(other)
+        return region
+
+    def mark(index, region):
+        # Marks every (placement, blank cell) pair of a region as visited.
+        for cell in region:
+            bit = index * size + cell
+            visited[bit >> 3] |= 1 << (bit & 7)
+
+    goal = sum((tile - 1) * weights[slot] for slot, tile in enumerate(p_pattern))
+    region = get_region(decode(goal), size - 1)
+    mark(goal, region)
+    table[goal] = 0
+    frontier = [(goal, region)]
+    distance = 0
+    while frontier:
+        distance += 1
+        next_frontier = []
+        for index, region in frontier:
+            occupied = decode(index)
+            for cell in region:
+                for other in neighbors[cell]:
+                    slot = occupied.get(other)
+                    if slot is None:
+                        continue
+                    # The pattern tile on other slides into the blank on cell.
+                    new_index = index + (cell - other) * weights[slot]
+                    bit = new_index * size + other
+                    if visited[bit >> 3] & (1 << (bit & 7)):
+                        continue
+                    if table[new_index] == 255:
+                        table[new_index] = distance
+                    del occupied[other]
+                    occupied[cell] = slot
+                    new_region = get_region(occupied, other)
+                    del occupied[cell]
+                    occupied[other] = slot
+                    mark(new_index, new_region)
+                    next_frontier.append((new_index, new_region))
+        frontier = next_frontier
+
+    return table
+
+
+def build_pattern_databases(p_dim, p_partition=None):
+    # Builds the disjoint pattern databases of a board dimension and writes them to PDB_DIR.
+    # Prints the build time and the table size of each database.
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_partition (tuple): tuples of tiles, defaults to PDB_PARTITIONS[p_dim]
+    # return: None
+
+    if p_partition is None:
+        p_partition = PDB_PARTITIONS[p_dim]
+    os.makedirs(PDB_DIR, exist_ok=True)
+
+    total_start = time.perf_counter()
+    for pattern in p_partition:
+        start = time.perf_counter()
+        table = build_pattern_database(p_dim, pattern)
+        path = get_pdb_path(p_dim, pattern)
+        with open(path, "wb") as file:
+            file.write(table)
+        print(f"Pattern {pattern}: {len(table):,} bytes, built in {time.perf_counter() - start:.1f}s -> {path}")
+    print(f"Built {len(p_partition)} pattern databases in {time.perf_counter() - total_start:.1f}s")
+
+    # Drop databases mapped before the rebuild.
+    pattern_databases.pop(p_dim, None)
+
+
+def load_pattern_databases(p_dim):
+    # Memory-maps the pattern databases of a board dimension, if they have been built.
+    # The files are mapped read-only, so all processes using them share one copy in the page cache.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a list of (pattern, table) tuples, or None if a database file is missing
+
+    if p_dim in pattern_databases:
+        return pattern_databases[p_dim]
+    if p_dim not in PDB_PARTITIONS:
+        return None
+
+    databases = []
+    for pattern in PDB_PARTITIONS[p_dim]:
+        path = get_pdb_path(p_dim, pattern)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as file:
+            table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        databases.append((pattern, table))
+    pattern_databases[p_dim] = databases
+
+    return databases
+
+
+def make_pdb_heuristic(p_databases):
+    # Builds a heuristic factory for ida_star that adds up disjoint pattern databases.
+    #
+    # param p_databases (list): (pattern, table) tuples as returned by load_pattern_databases
+    # return: a function that takes (tiles, dim) and returns the (h, update) pair
+
+    def make_heuristic(p_tiles, p_dim):
+        tables = [table for _, table in p_databases]
+        group_of = {}  # {tile: (database number, weight of the tile)}
+        indexes = []
+        for number, (pattern, _) in enumerate(p_databases):
+            weights = get_pattern_weights(p_dim, pattern)
+            for slot, tile in enumerate(pattern):
+                group_of[tile] = (number, weights[slot])
+            indexes.append(sum(p_tiles.index(tile) * weights[slot] for slot, tile in enumerate(pattern)))
+        group_of = [group_of.get(tile) for tile in range(p_dim * p_dim)]
+        state = [sum(tables[number][index] for number, index in enumerate(indexes))]
+
+        def update(tile, src, dst):
+            group = group_of[tile]
+            if group is None:
+                return state[0]
+            number, weight = group
+            table = tables[number]
+            index = indexes[number]
+            new_index = index + (dst - src) * weight
+            indexes[number] = new_index
+            state[0] += table[new_index] - table[index]
+            return state[0]
+
+        return state[0], update
+
+    return make_heuristic
+
+
+def rank_permutation(p_tiles):
+    # Ranks a permutation of 0..n-1 by its Lehmer code, in lexicographic order.
+    # e.g. [0, 1, 2] -> 0, [0, 2, 1] -> 1, [2, 1, 0] -> 5
+    #
+    # param p_tiles (list): the flattened board
+    # return: an integer between 0 and n!-1
+
+    rank = 0
+    length = len(p_tiles)
+    for i in range(length):
+        smaller = 0
+        for j in range(i + 1, length):
+            if p_tiles[j] < p_tiles[i]:
+                smaller += 1
+        rank = rank * (length - i) + smaller  # Horner's rule over the factorial number system
+
+    return rank
+
+
+def unrank_permutation(p_rank, p_length):
+    # Inverse of rank_permutation.
+    #
+    # param p_rank (int): the rank of the permutation
+    # param p_length (int): the number of elements
+    # return: a list which is the flattened board
+
+    digits = []
+    for radix in range(1, p_length + 1):
+        p_rank, digit = divmod(p_rank, radix)
+        digits.append(digit)
+    digits.reverse()
+
+    elements = list(range(p_length))
+    return [elements.pop(digit) for digit in digits]
+
+
+def build_distance_table():
+    # Computes the optimal distance of every 8-puzzle state by breadth-first search from the goal.
+    #
+    # return: a bytearray where table[rank] is the number of moves needed to solve the
+    #         board with that permutation rank (255 for unsolvable boards)
+
+    neighbors = get_neighbor_table(3)
+    goal = nested_to_linear_list(get_initial_board(3))
+    table = bytearray(b"\xff") * 362880  # 9! permutations
+    table[rank_permutation(goal)] = 0
+    frontier = [goal]
+    distance = 0
+    while frontier:
+        distance += 1
+        next_frontier = []
+        for tiles in frontier:
+            blank = tiles.index(0)
+            for _, target in neighbors[blank]:
+                new_tiles = tiles[:]
+                new_tiles[blank] = tiles[target]
+                new_tiles[target] = 0
+                rank = rank_permutation(new_tiles)
+                if table[rank] == 255:
+                    table[rank] = distance
+                    next_frontier.append(new_tiles)
+        frontier = next_frontier
+
+    return table
+
+
+def load_distance_table(p_build=False):
+    # Memory-maps the 8-puzzle distance table from DISTANCE_TABLE_PATH on first use, like load_pattern_databases.
+    #
+    # param p_build (bool): build and save the table if the file does not exist yet
+    # return: a read-only mmap indexed by permutation rank, or None if the table is not available
+
+    global distance_table
+
+    if distance_table is None:
+        if not os.path.exists(DISTANCE_TABLE_PATH) and p_build:
+            start = time.perf_counter()
+            table = build_distance_table()
+            os.makedirs(os.path.dirname(DISTANCE_TABLE_PATH), exist_ok=True)
+            with open(DISTANCE_TABLE_PATH, "wb") as file:
+                file.write(table)
+            reachable = len(table) - table.count(255)
+            print(f"8-puzzle distance table: {reachable:,} states, {len(table):,} bytes, "
+                  f"built in {time.perf_counter() - start:.1f}s -> {DISTANCE_TABLE_PATH}")
+        if os.path.exists(DISTANCE_TABLE_PATH):
+            with open(DISTANCE_TABLE_PATH, "rb") as file:
+                distance_table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    return distance_table
+
+
+def get_distance(p_board):
+    # Gets the optimal number of moves needed to solve an 8-puzzle board from the distance table.
+    #
+    # param p_board (list or PackedBoard): a 3x3 game board
+    # return: an integer, or None if the table has not been built (255 for an unsolvable board)
+
+    table = load_distance_table()
+    if table is None:
+        return None
+    if isinstance(p_board, PackedBoard):
+        return table[rank_permutation(p_board.to_list())]
+
+    return table[rank_permutation(nested_to_linear_list(p_board))]
+
+
+def walk_distance_table(p_tiles, p_table):
+    # Follows the distance table down to the goal, always moving to a state one move closer.
+    #
+    # param p_tiles (list): the flattened 3x3 board
+    # param p_table (mmap): the distance table
+    # return: list of direction indices, or None if the board is unsolvable
+
+    neighbors = get_neighbor_table(3)
+    tiles = list(p_tiles)
+    distance = p_table[rank_permutation(tiles)]
+    if distance == 255:
+        return None
+
+    path = []
+    blank = tiles.index(0)
+    while distance > 0:
+        for direction, target in neighbors[blank]:
+            tiles[blank] = tiles[target]
+            tiles[target] = 0
+            if p_table[rank_permutation(tiles)] == distance - 1:
+                break
+            tiles[target] = tiles[blank]  # Undo the move and try the next one
+            tiles[blank] = 0
+        path.append(direction)
+        blank = target
+        distance -= 1
+
+    return path
+
+
+def get_distance_index():
+    # Groups all solvable 8-puzzle states by their optimal distance, building the distance table if needed.
+    #
+    # return: a list where index[d] is an array of the permutation ranks of the states d moves from the goal
+
+    global distance_index
+
+    if distance_index is None:
+        table = memoryview(load_distance_table(p_build=True))  # Iterating a memoryview yields ints, unlike an mmap
+        index = [array.array("I") for _ in range(max(distance for distance in table if distance != 255) + 1)]
+        for rank, distance in enumerate(table):
+            if distance != 255:
+                index[distance].append(rank)
+        distance_index = index
+
+    return distance_index
+
+
+def get_puzzle_by_distance(p_dim, p_min, p_max=None):
+    # Generates a random board whose optimal solution length is between p_min and p_max.
+    # 8-puzzles are drawn uniformly from all states in the range using the distance index.
+    # Larger boards are made by a random walk from the goal until the board surely needs p_min
+    # moves, and then by following its optimal solution until a length in the range is left.
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_min (int): the smallest wanted solution length
+    # param p_max (int): the largest wanted solution length, defaults to p_min, at most MAX_DISTANCE[p_dim]
+    # return: a list which is the game board, or None if no state of a 3x3 board is in the range
+    #         or the random walks of a larger board did not get far enough (see get_difficulty_limit)
+
+    if p_max is None:
+        p_max = p_min
+
+    if p_dim == 3:
+        index = get_distance_index()
+        bands = [index[distance] for distance in range(p_min, min(p_max, len(index) - 1) + 1)]
+        total = sum(len(band) for band in bands)
+        if total == 0:
+            return None
+        # Pick uniformly among all states of the range.
+        pick = random.randrange(total)
+        for band in bands:
+            if pick < len(band):
+                tiles = unrank_permutation(band[pick], 9)
+                return [tiles[i*3:(i+1)*3] for i in range(3)]
+            pick -= len(band)
+
+    neighbors = get_neighbor_table(p_dim)
+    make_heuristic = get_heuristic(p_dim)
+    for _ in range(RANDOM_WALK_RESTARTS):
+        # Walk randomly from the goal until the heuristic, a lower bound of the
+        # solution length, shows that the board needs at least p_min moves.
+        tiles = nested_to_linear_list(get_initial_board(p_dim))
+        blank = len(tiles) - 1
+        last = -1
+        bound, update = make_heuristic(tiles, p_dim)
+        for _ in range(RANDOM_WALK_LIMIT * p_max):
+            # Move the blank in a random direction, never straight back.
+            direction, target = random.choice([move for move in neighbors[blank] if move[0] ^ 1 != last])
+            tile = tiles[target]
+            tiles[blank] = tile
+            tiles[target] = 0
+            bound = update(tile, target, blank)
+            blank = target
+            last = direction
+            if bound >= p_min:
+                break
+        else:
+            continue  # The walk did not get far enough, start again
+
+        # Every move of an optimal solution brings the board one move closer to the goal,
+        # so following it for a while gives a board of any smaller solution length.
+        board = pack_board([tiles[i*p_dim:(i+1)*p_dim] for i in range(p_dim)])
+        solution, _ = find_solution(board)
+        target = random.randint(p_min, min(p_max, len(solution)))
+        for name in solution[:len(solution) - target]:
+            board.move(DIRECTIONS.index(name))
+        return unpack_board(board)
+
+    return None
+
+
+def benchmark_difficulty(p_dim, p_bands, p_samples=20):
+    # Measures how long get_puzzle_by_distance takes for each difficulty band.
+    #
+    # param p_dim (int): the dimension of the board
+    # param p_bands (list): (min, max) solution length tuples
+    # param p_samples (int): the number of boards generated for each band
+    # return: None
+
+    limit = get_difficulty_limit(p_dim)
+    print(f"{p_dim}x{p_dim} band{'':<6}{'mean ms':>10}{'max ms':>10}")
+    for low, high in p_bands:
+        if high > limit:
+            print(f"{low:>3}-{high:<12}{'skipped, above ' + str(limit):>20}")
+            continue
+        times = []
+        for _ in range(p_samples):
+            start = time.perf_counter()
+            get_puzzle_by_distance(p_dim, low, high)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"{low:>3}-{high:<12}{sum(times) / len(times):>10.2f}{max(times):>10.2f}")
+
+
+def get_heuristic(p_dim):
+    # Chooses the best available heuristic of a dimension: the pattern databases if they
+    # have been built, otherwise Manhattan distance plus linear conflicts.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a function that takes (tiles, dim) and returns the (h, update) pair
+
+    databases = load_pattern_databases(p_dim)
+    if databases is None:
+        return make_md_lc_heuristic
+
+    return make_pdb_heuristic(databases)
+
+
+class SearchCancelled(Exception):
+    # Raised inside a search to unwind it when the caller asks it to stop.
+    pass
+
+
+def ida_star(p_tiles, p_dim, p_make_heuristic=make_md_lc_heuristic, p_should_stop=None):
+    # Searches an optimal solution with iterative deepening A*.
+    #
+    # param p_tiles (list): the flattened board, e.g. [1, 2, 3, 4, 5, 6, 7, 0, 8]
+    # param p_dim (int): the dimension of the board
+    # param p_make_heuristic (function): builds the (h, update) pair of an admissible heuristic
+    # param p_should_stop (function): called every few thousand nodes, the search gives up when it returns True
+    # return: (list of direction indices, number of nodes expanded)
+    #         The list is None if the search was stopped.
+
+    tiles = list(p_tiles)
+    neighbors = get_neighbor_table(p_dim)
+    h, update = p_make_heuristic(tiles, p_dim)
+    path = []
+    nodes = 0
+
+    def search(blank, g, h, bound, last):
+        # Returns -1 if the goal was found, otherwise the smallest f-value above bound.
+        nonlocal nodes
+        if h == 0:
+            return -1
+        nodes += 1
+        if nodes & 4095 == 0 and p_should_stop is not None and p_should_stop():
+            raise SearchCancelled
+        minimum = float("inf")
+        for direction, target in neighbors[blank]:
+            if direction ^ 1 == last:
+                continue  # Never undo the previous move
+            tile = tiles[target]
+            tiles[blank] = tile
+            tiles[target] = 0
+            new_h = update(tile, target, blank)
+            f = g + 1 + new_h
+            if f <= bound:
+                path.append(direction)
+                f = search(target, g + 1, new_h, bound, direction)
+                if f < 0:
+                    return f
+                path.pop()
+            tiles[target] = tile
+            tiles[blank] = 0
+            update(tile, blank, target)
+            if f < minimum:
+                minimum = f
+        return minimum
+
+    bound = h
+    while True:
+        try:
+            result = search(tiles.index(0), 0, h, bound, -1)
+        except SearchCancelled:
+            return None, nodes
+        if result < 0:
+            return path, nodes
+        bound = result
+
+
+def find_solution(p_board, p_should_stop=None):
+    # Finds an optimal solution of the board as a list of direction names.
+    #
+    # param p_board (list or PackedBoard): the game board
+    # param p_should_stop (function): optional, the search gives up when it returns True
+    # return: (list of direction names, e.g. ["UP", "LEFT"], dictionary of search statistics)
+    #         The list is None if the board is not solvable or the search was stopped.
+
+    if isinstance(p_board, PackedBoard):
+        p_board = unpack_board(p_board)
+
+    dim = len(p_board)
+    stats = {"nodes": 0, "seconds": 0.0, "nodes_per_sec": 0.0}
+    if not is_solvable(p_board):
+        return None, stats
+
+    # Solve 8-puzzles by walking the distance table if it has been built.
+    table = load_distance_table() if dim == 3 else None
+    if table is not None:
+        start = time.perf_counter()
+        path = walk_distance_table(nested_to_linear_list(p_board), table)
+        stats["nodes"] = len(path)
+        stats["seconds"] = time.perf_counter() - start
+        if stats["seconds"] > 0:
+            stats["nodes_per_sec"] = stats["nodes"] / stats["seconds"]
+        return [DIRECTIONS[direction] for direction in path], stats
+
+    start = time.perf_counter()
+    path, nodes = ida_star(nested_to_linear_list(p_board), dim, get_heuristic(dim), p_should_stop)
+    seconds = time.perf_counter() - start
+
+    stats["nodes"] = nodes
+    stats["seconds"] = seconds
+    if seconds > 0:
+        stats["nodes_per_sec"] = nodes / seconds
+    if path is None:
+        return None, stats
+
+    return [DIRECTIONS[direction] for direction in path], stats
+
+
+class SolutionCache:
+    # Optimal solutions stored on disk by the Zobrist hash of the board, with least recently used eviction.
+    # The tiles are stored too, so a hash collision is a miss rather than a wrong solution.
+
+    def __init__(self, p_path=SOLUTION_CACHE_PATH, p_capacity=SOLUTION_CACHE_SIZE):
+        # param p_path (str): the database file, created if missing
+        # param p_capacity (int): the most solutions kept
+        self.capacity = p_capacity
+        self.lock = threading.Lock()
+        self.clock = 0  # Last use stamp handed out, stamps order the rows by recency
+        self.connection = sqlite3.connect(p_path, timeout=30, check_same_thread=False)
+        with self.connection:
+            self.connection.execute("CREATE TABLE IF NOT EXISTS solutions ("
+                                    "hash INTEGER PRIMARY KEY, tiles TEXT NOT NULL, "
+                                    "solution TEXT NOT NULL, used INTEGER NOT NULL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+        self.clock = self.connection.execute("SELECT COALESCE(MAX(used), 0) FROM solutions").fetchone()[0]
+
+    @staticmethod
+    def get_key(p_board):
+        # Returns the (hash, tiles) key of a board as stored in the database.
+        if not isinstance(p_board, PackedBoard):
+            p_board = pack_board(p_board)
+        return p_board.hash, ",".join(map(str, p_board.to_list()))
+
+    def get(self, p_board):
+        # Returns the cached solution of a board as a list of direction names, or None if missing.
+        board_hash, tiles = SolutionCache.get_key(p_board)
+        with self.lock, self.connection:
+            row = self.connection.execute("SELECT tiles, solution FROM solutions WHERE hash = ?",
+                                          (board_hash,)).fetchone()
+            if row is None or row[0] != tiles:
+                return None
+            self.clock += 1
+            self.connection.execute("UPDATE solutions SET used = ? WHERE hash = ?", (self.clock, board_hash))
+        return [DIRECTIONS["LRUD".index(letter)] for letter in row[1]]
+
+    def put(self, p_board, p_solution):
+        # Stores the solution of a board, given as a list of direction names, evicting old ones if full.
+        board_hash, tiles = SolutionCache.get_key(p_board)
+        solution = "".join(name[0] for name in p_solution)
+        with self.lock, self.connection:
+            self.clock += 1
+            self.connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)",
+                                    (board_hash, tiles, solution, self.clock))
+            self.connection.execute("DELETE FROM solutions WHERE hash IN (SELECT hash FROM solutions "
+                                    "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.capacity,))
+
+    def close(self):
+        # Closes the database file.
+        self.connection.close()
+
+
+def get_solution_cache():
+    # Returns the solution cache, opening it on first use.
+    # return: a SolutionCache, or None if the file cannot be opened
+
+    global solution_cache
+    if solution_cache is None:
+        try:
+            solution_cache = SolutionCache()
+        except sqlite3.Error as error:
+            logger.warning("solution cache disabled: %s", error)
+            solution_cache = False  # Do not try again
+    return solution_cache or None
+
+
+def find_cached_solution(p_board, p_should_stop=None):
+    # Like find_solution, but answers from the solution cache when the board was solved before,
+    # and stores new solutions in it.
+    #
+    # param p_board (list or PackedBoard): the game board
+    # param p_should_stop (function): optional, the search gives up when it returns True
+    # return: (list of direction names, dictionary of search statistics with "cached" set)
+
+    cache = get_solution_cache()
+    if cache is not None:
+        solution = cache.get(p_board)
+        if solution is not None:
+            return solution, {"nodes": 0, "seconds": 0.0, "nodes_per_sec": 0.0, "cached": True}
+
+    solution, stats = find_solution(p_board, p_should_stop)
+    stats["cached"] = False
+    if cache is not None and solution is not None:
+        cache.put(p_board, solution)
+
+    return solution, stats
+
+
+def solve_puzzle(p_board, p_keys=DEFAULT_KEYS):
+    # Finds an optimal sequence of moves that solves the board.
+    #
+    # param p_board (list or PackedBoard): the game board, it is not modified
+    # param p_keys (dict): the key of each move, see DEFAULT_KEYS
+    # return: (list of move keys, e.g. ["w", "a"], dictionary with "nodes", "seconds" and "nodes_per_sec")
+    #         The list is None if the board is not solvable.
+
+    solution, stats = find_cached_solution(p_board)
+    if solution is None:
+        return None, stats
+
+    return [p_keys[direction] for direction in solution], stats
+
+
+def get_solution_stages(p_dim):
+    # Splits solving a board into stages for find_bounded_solution.
+    # The top row and the left column are placed a few tiles at a time and then frozen, which
+    # leaves a board one size smaller, until the last 3x3 block is solved in one stage.
+    #
+    # param p_dim (int): the dimension of the board
+    # return: a list of (target tiles, frozen cells) tuples; each stage brings its
+    #         target tiles home without moving the tiles on the frozen cells
+
+    stages = []
+    frozen = set()
+    for k in range(p_dim - 3):
+        row = [k*p_dim + x + 1 for x in range(k, p_dim)]  # Tiles of row k from column k on
+        col = [y*p_dim + k + 1 for y in range(k + 1, p_dim)]  # Tiles of column k below row k
+        for line in (row, col):
+            # Add STAGE_TILES more tiles of the line to the targets in each stage.
+            for count in list(range(STAGE_TILES, len(line), STAGE_TILES)) + [len(line)]:
+                stages.append((tuple(line[:count]), frozenset(frozen)))
+            frozen.update(tile - 1 for tile in line)
+
+    start = p_dim - 3 if p_dim > 3 else 0
+    block = [y*p_dim + x + 1 for y in range(start, p_dim) for x in range(start, p_dim)][:-1]
+    stages.append((tuple(block), frozenset(frozen)))
+
+    return stages
+
+
+def weighted_astar(p_tiles, p_dim, p_targets, p_frozen, p_weight, p_max_nodes, p_deadline=None, p_should_stop=None):
+    # Brings some target tiles home with weighted A*, keeping the frozen cells untouched.
+    # A state only holds the positions of the blank and of the target tiles, since the other
+    # tiles do not matter for this goal. When the search has stored p_max_nodes states or passed
+    # the deadline, it keeps the path to the best state found so far and starts again from there
+    # with a fresh table and a greedier weight, so memory stays below the cap.
+    #
+    # param p_tiles (list): the flattened board, it is not modified
+    # param p_dim (int): the dimension of the board
+    # param p_targets (tuple): the tiles to bring home
+    # param p_frozen (frozenset): flattened indexes of the cells the blank must not enter
+    # param p_weight (float): weight of the heuristic, 1 for optimal solutions
+    # param p_max_nodes (int): the most states kept in memory at once
+    # param p_deadline (float): time.perf_counter() value after which the search turns greedy
+    # param p_should_stop (function): called every thousand nodes, the search gives up when it returns True
+    # return: (list of direction indices, number of nodes expanded)
+    #         The list is None if the search gave up.
+
+    neighbors = get_neighbor_table(p_dim)
+    manhattan = get_manhattan_table(p_dim)
+    targets = p_targets
+    weight = p_weight
+
+    def heuristic(state):
+        # Manhattan distance of the targets, plus the moves the blank needs to reach
+        # a misplaced target before that target can move.
+        blank_y, blank_x = divmod(state[0], p_dim)
+        h = 0
+        reach = None
+        for tile, pos in zip(targets, state[1:]):
+            distance = manhattan[tile][pos]
+            if distance:
+                h += distance
+                y, x = divmod(pos, p_dim)
+                steps = abs(y - blank_y) + abs(x - blank_x) - 1
+                if reach is None or steps < reach:
+                    reach = steps
+        return h if reach is None else h + reach
+
+    state = (p_tiles.index(0),) + tuple(p_tiles.index(tile) for tile in targets)
+    path = []
+    nodes = 0
+    while heuristic(state) > 0:
+        if p_deadline is not None and time.perf_counter() > p_deadline:
+            weight = max(weight, GREEDY_WEIGHT)  # Out of time, finish as fast as possible
+        parents = {state: None}
+        best_h = heuristic(state)
+        best = state
+        found = None
+        heap = [(weight * best_h, 0, state)]
+        while heap and found is None and len(parents) < p_max_nodes:
+            _, g, current = heapq.heappop(heap)
+            nodes += 1
+            if nodes & 1023 == 0:
+                if p_should_stop is not None and p_should_stop():
+                    return None, nodes
+                if p_deadline is not None and time.perf_counter() > p_deadline:
+                    break
+            blank = current[0]
+            for direction, target in neighbors[blank]:
+                if target in p_frozen:
+                    continue
+                new_state = list(current)
+                new_state[0] = target
+                if target in current:
+                    new_state[current.index(target, 1)] = blank  # A target tile slides into the blank
+                new_state = tuple(new_state)
+                if new_state in parents:
+                    continue
+                parents[new_state] = (current, direction)
+                h = heuristic(new_state)
+                if h == 0:
+                    found = new_state
+                    break
+                if h < best_h:
+                    best_h = h
+                    best = new_state
+                heapq.heappush(heap, (g + 1 + weight * h, g + 1, new_state))
+
+        end = found if found is not None else best
+        segment = []
+        node = end
+        while parents[node] is not None:
+            node, direction = parents[node]
+            segment.append(direction)
+        segment.reverse()
+        path.extend(segment)
+        if end == state:
+            weight *= 2  # No progress within the cap, search greedier
+        state = end
+
+    return path, nodes
+
+
+def find_bounded_solution(p_board, p_weight=BOUNDED_WEIGHT, p_max_nodes=BOUNDED_MAX_NODES, p_time_budget=None,
+                          p_should_stop=None):
+    # Finds a good, not necessarily optimal, solution of a board of any dimension within a memory cap.
+    # The board is solved in stages (see get_solution_stages) with weighted A* (see weighted_astar).
+    #
+    # param p_board (list or PackedBoard): the game board
+    # param p_weight (float): weight of the heuristic, higher is faster but gives longer solutions
+    # param p_max_nodes (int): the most search states kept in memory at once
+    # param p_time_budget (float): seconds after which the search turns greedy to finish quickly
+    # param p_should_stop (function): optional, the search gives up when it returns True
+    # return: (list of direction names, dictionary of search statistics)
+    #         The list is None if the board is not solvable or the search gave up.
+
+    if isinstance(p_board, PackedBoard):
+        p_board = unpack_board(p_board)
+
+    dim = len(p_board)
+    stats = {"nodes": 0, "seconds": 0.0, "nodes_per_sec": 0.0}
+    if not is_solvable(p_board):
+        return None, stats
+
+    start = time.perf_counter()
+    deadline = None if p_time_budget is None else start + p_time_budget
+    tiles = nested_to_linear_list(p_board)
+    neighbors = get_neighbor_table(dim)
+    path = []
+    for targets, frozen in get_solution_stages(dim):
+        segment, nodes = weighted_astar(tiles, dim, targets, frozen, p_weight, p_max_nodes, deadline, p_should_stop)
+        stats["nodes"] += nodes
+        if segment is None:
+            path = None
+            break
+        # Apply the stage to the board.
+        blank = tiles.index(0)
+        for direction in segment:
+            target = dict(neighbors[blank])[direction]
+            tiles[blank] = tiles[target]
+            tiles[target] = 0
+            blank = target
+        path.extend(segment)
+
+    stats["seconds"] = time.perf_counter() - start
+    if stats["seconds"] > 0:
+        stats["nodes_per_sec"] = stats["nodes"] / stats["seconds"]
+    if path is None:
+        return None, stats
+
+    return [DIRECTIONS[direction] for direction in path], stats
+
+
+class HintProvider:
+    # Gives the next move of a SlidingPuzzle game, optimal for boards up to 4x4 when the search
+    # finishes within the budget, otherwise from a good solution (see find_bounded_solution).
+    # The solution found for a board is cached and reused while the player follows it; the
+    # solver only runs again, in a background thread, when the player leaves the cached path.
+
+    def __init__(self, p_game, p_latency=HINT_LATENCY, p_budget=HINT_TIME_BUDGET):
+        # param p_game (SlidingPuzzle): the game to give hints for
+        # param p_latency (float): longest time in seconds get_hint waits for a running search
+        # param p_budget (float): longest time in seconds a search may run
+        self.game = p_game
+        self.latency = p_latency
+        self.budget = p_budget
+        self.lock = threading.Lock()
+        self.path = []  # Remaining directions of the cached solution
+        self.path_state = None  # Packed state the remaining path starts from
+        self.search_state = None  # Packed state the last search solved
+        self.generation = 0  # Incremented to cancel the running search
+        self.done = threading.Event()  # Set when no search is running
+        self.done.set()
+        if not p_game.is_solved():
+            self.start_search()
+
+    def start_search(self):
+        # Cancels any running search and starts a new one for the current board.
+        board = self.game.board.copy()
+        with self.lock:
+            self.generation += 1
+            self.path = []
+            self.path_state = None
+            self.done.clear()
+            thread = threading.Thread(target=self.search, args=(board, self.generation), daemon=True)
+        thread.start()
+
+    def search(self, p_board, p_generation):
+        # Runs in the background thread and stores the solution if the search is still wanted.
+        deadline = time.perf_counter() + self.budget
+
+        def should_stop():
+            return self.generation != p_generation or time.perf_counter() > deadline
+
+        if p_board.dim <= 4:
+            solution, stats = find_cached_solution(p_board, should_stop)
+            if solution is None and self.generation == p_generation:
+                # Out of time, a good solution is better than leaving the player without hints
+                logger.info("optimal hint search gave up after %d nodes in %.3fs", stats["nodes"], stats["seconds"])
+                solution, stats = find_bounded_solution(p_board, p_should_stop=lambda: self.generation != p_generation)
+        else:
+            # Optimal solutions of bigger boards are out of reach, give a good one instead.
+            solution, stats = find_bounded_solution(p_board, p_should_stop=should_stop)
+        with self.lock:
+            if self.generation != p_generation:
+                return  # A newer search has replaced this one
+            if solution is not None:
+                self.path = [DIRECTIONS.index(name) for name in solution]
+                self.path_state = p_board.state
+                self.search_state = p_board.state
+                logger.info("hint search solved the board in %d moves: %d nodes in %.3fs",
+                            len(solution), stats["nodes"], stats["seconds"])
+            else:
+                logger.info("hint search gave up after %d nodes in %.3fs", stats["nodes"], stats["seconds"])
+            self.done.set()
+
+    def on_moves(self, p_keys):
+        # Updates the cached path after the player applied a string of move keys.
+        directions = self.game.directions
+        with self.lock:
+            followed = 0
+            while followed < len(p_keys) and self.path and self.path[0] == directions.get(p_keys[followed]):
+                self.path.pop(0)  # The player followed the path, keep the rest of it
+                followed += 1
+            if followed == len(p_keys):
+                self.path_state = self.game.board.state
+                return
+        if not self.game.is_solved():
+            self.start_search()  # The player left the path, solve the new board
+
+    def get_hint(self):
+        # Returns the key of the next move, or None if no solution is ready within the latency.
+        start = time.perf_counter()
+        self.done.wait(self.latency)  # Only blocks while a search is running
+        latency = (time.perf_counter() - start) * 1000
+        with self.lock:
+            if not self.path or self.path_state != self.game.board.state:
+                logger.info("hint not ready after %.1f ms", latency)
+                return None
+            source = "search" if self.path_state == self.search_state else "cache"
+            key = self.game.keys[DIRECTIONS[self.path[0]]]
+        logger.info("hint %r from %s in %.1f ms", key, source, latency)
+        return key
+
+
+def require_numpy():
+    # Raises ImportError if NumPy, which the batch functions need, is not installed.
+    #
+    # return: None
+
+    if np is None:
+        raise ImportError("NumPy is required for the batch puzzle functions (pip install numpy)")
+
+
+def batch_blank_index(p_boards):
+    # Finds the flattened index of the blank tile of many boards at once.
+    #
+    # param p_boards (numpy.ndarray): (N, dim*dim) array of boards
+    # return: (N,) int64 array of blank indices
+
+    require_numpy()
+    return np.argmin(p_boards, axis=1)  # The blank (0) is the smallest element
+
+
+def batch_blank_pos(p_boards, p_dim):
+    # Finds the position of the blank tile of many boards at once.
+    #
+    # param p_boards (numpy.ndarray): (N, dim*dim) array of boards
+    # param p_dim (int): the dimension of the boards
+    # return: (N, 2) int64 array of (y, x) positions, like get_blank_pos
+
+    blank = batch_blank_index(p_boards)
+    return np.stack(np.divmod(blank, p_dim), axis=1)
+
+
+def batch_count_inv(p_boards):
+    # Counts the inversions of many flattened boards at once, ignoring the blank.
+    #
+    # param p_boards (numpy.ndarray): (N, dim*dim) array of boards
+    # return: (N,) int64 array of inversion counts
+
+    require_numpy()
+    length = p_boards.shape[1]
+    inversions = np.zeros(len(p_boards), dtype=np.int64)
+    # Compare every column with all columns after it.
+    for i in range(length - 1):
+        inversions += (p_boards[:, i:i+1] > p_boards[:, i+1:]).sum(axis=1)
+
+    # Every tile in front of the blank was counted once against it, so remove those pairs.
+    return inversions - batch_blank_index(p_boards)
+
+
+def batch_is_solvable(p_boards, p_dim):
+    # Checks the solvability of many boards at once, with the same rule as is_solvable.
+    #
+    # param p_boards (numpy.ndarray): (N, dim*dim) array of boards
+    # param p_dim (int): the dimension of the boards
+    # return: (N,) bool array
+
+    inversions = batch_count_inv(p_boards)
+    if p_dim % 2 == 1:
+        return inversions % 2 == 0
+
+    # For even dimensions the inversions and the blank row counted from the bottom must differ in parity.
+    blank_row_bottom = p_dim - batch_blank_index(p_boards) // p_dim
+    return (inversions + blank_row_bottom) % 2 == 1
+
+
+def batch_manhattan(p_boards, p_dim):
+    # Computes the Manhattan distance of many boards at once.
+    #
+    # param p_boards (numpy.ndarray): (N, dim*dim) array of boards
+    # param p_dim (int): the dimension of the boards
+    # return: (N,) int64 array of distances
+
+    require_numpy()
+    # distance[tile, index] is the distance of tile at flattened index to its goal.
+    distance = np.array(get_manhattan_table(p_dim), dtype=np.int16)
+    cells = np.arange(p_dim * p_dim)
+    return distance[p_boards, cells].sum(axis=1, dtype=np.int64)
+
+
+def get_puzzle_batch(p_count, p_dim, p_seed=None):
+    # Generates many uniformly random solvable boards at once.
+    # Unsolvable shuffles are fixed like in get_solvable_puzzle, by swapping the
+    # tiles in the first two cells that do not hold the blank.
+    #
+    # param p_count (int): the number of boards
+    # param p_dim (int): the dimension of the boards
+    # param p_seed (int): seed of the random generator, or None for a random seed
+    # return: (p_count, p_dim*p_dim) uint8 array of flattened boards
+
+    require_numpy()
+    rng = np.random.default_rng(p_seed)
+    elements = np.arange(p_dim * p_dim, dtype=np.uint8)
+    boards = rng.permuted(np.broadcast_to(elements, (p_count, p_dim * p_dim)), axis=1)
+
+    rows = np.flatnonzero(~batch_is_solvable(boards, p_dim))
+    blank = batch_blank_index(boards[rows])
+    first = np.where(blank == 0, 1, 0)
+    second = np.where(blank <= 1, 2, 1)
+    tiles = boards[rows, first]
+    boards[rows, first] = boards[rows, second]
+    boards[rows, second] = tiles
+
+    return boards
+
+
+def benchmark_batch(p_count=1000000, p_dim=4, p_sample=20000):
+    # Compares the throughput of the batch functions with the per-board functions.
+    #
+    # param p_count (int): the number of boards for the batch functions
+    # param p_dim (int): the dimension of the boards
+    # param p_sample (int): the number of boards for the slower per-board functions
+    # return: None
+
+    start = time.perf_counter()
+    boards = get_puzzle_batch(p_count, p_dim)
+    generate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    solvable = batch_is_solvable(boards, p_dim)
+    check = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch_blank_pos(boards, p_dim)
+    batch_manhattan(boards, p_dim)
+    metrics = time.perf_counter() - start
+
+    start = time.perf_counter()
+    sample = [get_solvable_puzzle(p_dim) for _ in range(p_sample)]
+    single_generate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for board in sample:
+        is_solvable(board)
+    single_check = time.perf_counter() - start
+
+    print(f"{p_dim}x{p_dim} boards, all solvable: {bool(solvable.all())}")
+    print(f"{'':<22}{'batch':>16}{'per board':>16}{'speedup':>10}")
+    for name, batch_time, single_time in (("generate solvable", generate, single_generate),
+                                          ("check solvability", check, single_check)):
+        batch_rate = p_count / batch_time
+        single_rate = p_sample / single_time
+        print(f"{name:<22}{batch_rate:>12,.0f}/s{single_rate:>12,.0f}/s{batch_rate / single_rate:>9.1f}x")
+    print(f"{'blank + manhattan':<22}{p_count / metrics:>12,.0f}/s")
+
+
+def save_puzzles(p_path, p_boards):
+    # Writes boards to a text file, one per line: an instance number followed by the flattened tiles.
+    #
+    # param p_path (str): the file to write
+    # param p_boards (list): nested list boards
+    # return: None
+
+    with open(p_path, "w") as file:
+        for number, board in enumerate(p_boards, 1):
+            file.write(f"{number} " + " ".join(str(tile) for tile in nested_to_linear_list(board)) + "\n")
+
+
+def load_puzzles(p_path, p_blank_first=False):
+    # Reads boards from a text file with one board per line, as written by save_puzzles.
+    # The instance number is optional, and blank lines and lines starting with "#" are skipped.
+    # Boards whose goal has the blank first (0 1 2 ... 15, as in Korf's 100 15-puzzles) are
+    # converted by turning them 180 degrees and renumbering tile t to n-t, which maps that goal
+    # onto ours and keeps every solution length.
+    #
+    # param p_path (str): the file to read
+    # param p_blank_first (bool): whether the boards use the blank-first goal
+    # return: a list of (name, board) tuples
+
+    puzzles = []
+    with open(p_path) as file:
+        for line in file:
+            line = line.strip()
+            if line == "" or line.startswith("#"):
+                continue
+            numbers = [int(word) for word in line.split()]
+            dim = int(len(numbers) ** 0.5)
+            if dim * dim == len(numbers):
+                name = str(len(puzzles) + 1)
+            else:
+                dim = int((len(numbers) - 1) ** 0.5)
+                name = str(numbers.pop(0))
+            tiles = numbers
+            if p_blank_first:
+                size = dim * dim
+                tiles = [size - tile if tile else 0 for tile in reversed(tiles)]
+            puzzles.append((name, [tiles[i*dim:(i+1)*dim] for i in range(dim)]))
+
+    return puzzles
+
+
+def solve_instance(p_puzzle):
+    # Solves one puzzle; runs in a worker process of solve_puzzle_file.
+    #
+    # param p_puzzle (tuple): (name, board, whether to use the bounded-suboptimal solver)
+    # return: (name, solution length or None, dictionary of search statistics)
+
+    name, board, bounded = p_puzzle
+    if bounded:
+        solution, stats = find_bounded_solution(board)
+    else:
+        solution, stats = find_solution(board)
+    return name, None if solution is None else len(solution), stats
+
+
+def init_solver_worker():
+    # Maps the heuristic tables once in each worker process, see load_pattern_databases.
+    #
+    # return: None
+
+    load_distance_table()
+    for dim in PDB_PARTITIONS:
+        load_pattern_databases(dim)
+
+
+def solve_puzzle_file(p_path, p_workers=None, p_blank_first=False, p_bounded=False):
+    # Solves all puzzles of a file in parallel and prints a results table.
+    #
+    # param p_path (str): the file of puzzles, see load_puzzles
+    # param p_workers (int): number of worker processes, defaults to the number of cores
+    # param p_blank_first (bool): whether the boards use the blank-first goal
+    # param p_bounded (bool): use the bounded-suboptimal solver instead of the optimal one
+    # return: None
+
+    puzzles = [(name, board, p_bounded) for name, board in load_puzzles(p_path, p_blank_first)]
+    workers = p_workers or os.cpu_count()
+    print(f"Solving {len(puzzles)} puzzles from {p_path} with {workers} worker processes")
+    print(f"{'instance':>10}{'length':>8}{'nodes':>14}{'seconds':>10}{'nodes/sec':>12}")
+
+    total_nodes = 0
+    total_seconds = 0.0
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_solver_worker) as pool:
+        # imap keeps the input order while the workers take one puzzle at a time.
+        for name, length, stats in pool.imap(solve_instance, puzzles):
+            total_nodes += stats["nodes"]
+            total_seconds += stats["seconds"]
+            length = "-" if length is None else length  # Unsolvable board
+            print(f"{name:>10}{length:>8}{stats['nodes']:>14,}{stats['seconds']:>10.2f}{stats['nodes_per_sec']:>12,.0f}")
+    wall = time.perf_counter() - start
+
+    print(f"{'total':>10}{'':>8}{total_nodes:>14,}{total_seconds:>10.2f}{total_nodes / max(total_seconds, 1e-9):>12,.0f}")
+    print(f"Wall time {wall:.2f}s, {total_nodes / max(wall, 1e-9):,.0f} nodes/sec over all workers, "
+          f"speedup {total_seconds / max(wall, 1e-9):.1f}x")
+
+
+def benchmark_sizes(p_sizes=range(3, MAX_DIM + 1), p_samples=3):
+    # Reports the solution quality and solve time of the bounded-suboptimal solver for each board size.
+    # Quality is compared with the optimal length where it can be computed (up to 4x4) and
+    # with the Manhattan distance plus linear conflict lower bound otherwise.
+    #
+    # param p_sizes (iterable): the board dimensions
+    # param p_samples (int): the number of random boards of each size
+    # return: None
+
+    print(f"{'size':<7}{'length':>9}{'optimal':>9}{'bound':>9}{'ratio':>7}{'seconds':>9}{'nodes':>10}")
+    for dim in p_sizes:
+        lengths, optimal, bounds, seconds, nodes = [], [], [], [], []
+        for _ in range(p_samples):
+            board = get_solvable_puzzle(dim)
+            solution, stats = find_bounded_solution(board)
+            lengths.append(len(solution))
+            seconds.append(stats["seconds"])
+            nodes.append(stats["nodes"])
+            bounds.append(make_md_lc_heuristic(nested_to_linear_list(board), dim)[0])
+            if dim <= 4:
+                optimal.append(len(find_solution(board)[0]))
+        reference = optimal if optimal else bounds
+        ratio = sum(lengths) / sum(reference)
+        optimal_text = f"{sum(optimal) / p_samples:.1f}" if optimal else "-"
+        print(f"{dim}x{dim:<5}{sum(lengths) / p_samples:>9.1f}{optimal_text:>9}{sum(bounds) / p_samples:>9.1f}"
+              f"{ratio:>7.2f}{sum(seconds) / p_samples:>9.2f}{sum(nodes) // p_samples:>10,}")
+
+
+def parse_arguments():
+    # Reads the command-line options. Without any option the interactive game starts.
+    #
+    # return: argparse.Namespace of the options
+
+    parser = argparse.ArgumentParser(description="Sliding puzzle game, solver and benchmarks.")
+    parser.add_argument("--build-pdb", action="store_true",
+                        help="build the 8-puzzle distance table and the 15-puzzle pattern databases")
+    parser.add_argument("--solve", metavar="FILE", help="solve the puzzles in FILE in parallel")
+    parser.add_argument("--workers", type=int, help="number of worker processes for --solve")
+    parser.add_argument("--bounded", action="store_true",
+                        help="solve with the fast bounded-suboptimal solver, for boards bigger than 4x4")
+    parser.add_argument("--blank-first", action="store_true",
+                        help="the puzzles of --solve use the goal 0 1 2 ... (e.g. Korf's 100 15-puzzles)")
+    parser.add_argument("--generate", type=int, metavar="COUNT", help="write COUNT random solvable puzzles")
+    parser.add_argument("--dim", type=int, default=4, help="board dimension for --generate")
+    parser.add_argument("--out", default="puzzles.txt", help="output file for --generate")
+    parser.add_argument("--replay", metavar="FILE", help='replay the game in FILE ("-" for the standard input)')
+    parser.add_argument("--benchmark-batch", action="store_true", help="benchmark the NumPy batch functions")
+    parser.add_argument("--benchmark-difficulty", action="store_true",
+                        help="benchmark puzzle generation by difficulty")
+    parser.add_argument("--benchmark-sizes", action="store_true",
+                        help="benchmark the bounded-suboptimal solver on each board size")
+
+    return parser.parse_args()
+
+
+def format_board(p_board):
+    # Builds the text of the game board, e.g.
     # 1  2  3
     # 4  5  6
     # 7  8   
     #
-    # param p_board (list): the board to be printed
+    # param p_board (list or PackedBoard): the board to be shown
+    # return: string containing the board, one line per row
+
+    if isinstance(p_board, PackedBoard):
+        p_board = unpack_board(p_board)
+
+    # The blank tile is represented by an empty space.
+    lines = []
+    for row in p_board:
+        lines.append("".join("   " if tile == 0 else "%-2s " % tile for tile in row))
+
+    return "\n".join(lines)
+
+
+def print_board(p_board):
+    # Prints the game board with a single print call.
+    #
+    # param p_board (list or PackedBoard): the board to be printed
     # return: None
 
-    dim = len(p_board)  # Get the dimension of the board
-    # Print the board
-    for i in range(dim):
-        for j in range(dim):
-            if p_board[i][j] == 0:
-                print("  ", end=" ") # The blank tile is represented by an empty space
-            else:
-                print("%-2s" %(p_board[i][j]), end=" ")
-        print()
+    print(format_board(p_board))
 
 
-def main():
-    global answer_board
+def replay_file(p_path):
+    # Replays a game from a file and prints the final board once.
+    # The first line holds the starting board like a line of save_puzzles, the second line the
+    # four keys for left, right, up and down, and the rest of the file the moves, e.g.
+    # 1 2 3 4 5 6 0 7 8
+    # a d w s
+    # aa
+    #
+    # param p_path (str): the replay file, or "-" to read it from the standard input
+    # return: the SlidingPuzzle after the moves
+
+    file = sys.stdin if p_path == "-" else open(p_path)
+    with file:
+        lines = file.read().split("\n")
+    numbers = [int(word) for word in lines[0].split()]
+    dim = int(len(numbers) ** 0.5)
+    if dim * dim != len(numbers):
+        numbers.pop(0)  # Skip the instance number
+    board = [numbers[i*dim:(i+1)*dim] for i in range(dim)]
+    keys = dict(zip(DIRECTIONS, lines[1].lower().split()))
+    moves_text = "".join("".join(lines[2:]).lower().split())
 
+    game = SlidingPuzzle(board, keys)
+    position = game.find_invalid_move(moves_text)
+    if position >= 0:
+        print(f"Move {position + 1} ({moves_text[position]}) is not available, the replay stops before it.")
+        moves_text = moves_text[:position]
+    game.apply_moves(moves_text)
+    print(format_board(game.board))
+    print(f"{game.steps} moves replayed, the puzzle is {'solved' if game.is_solved() else 'not solved'}.")
+
+    return game
+
+
+def main():
     # Print brief introduction of the game.
     print("Welcome to Sliding Puzzle game!")
     print("In this game, you will try to rearrange a randomized puzzle by sliding tiles into the blank tile until it becomes in order.")
-    print("There are two choices of game: 8-puzzle (3x3 grid) and 15-puzzle (4x4 grid).")
+    print(f"You can play the 8-puzzle (3x3 grid), the 15-puzzle (4x4 grid), or a bigger grid up to {MAX_DIM}x{MAX_DIM}.")
     print("You may choose your own distinct keys for left, right, up, and down move.")
     print("Let's start the game!")
     print("Firstly, choose your keys for your move, four distinct letters each separated by a space.")
     
+    print(f"Stuck? Enter {HINT_KEY} for a hint.")
+
+    logging.basicConfig(filename=HINT_LOG_FILE, level=logging.INFO, format="%(asctime)s %(message)s")
+
     # Prompt user for keys input
-    prompt_assign_keys()
+    keys = prompt_assign_keys()
 
     # Repeat until user quits the game
     while True:
@@ -404,33 +2212,62 @@ def main():
             break # User quits the game
         elif choice == "1":
             dim = 3  # Set the dimension of board to 3, creating a 3x3 game board (8-puzzle)
-        else:
+        elif choice == "2":
             dim = 4  # Set the dimension of board to 4, creating a 4x4 game board (15-puzzle)
+        else:
+            dim = int(choice)  # Bigger boards are chosen by their dimension
 
-        answer_board = get_initial_board(dim)  # Generate the answer board
-
-        # Generate and print the game board
-        current_board = get_new_puzzle(dim)
-        while not is_solvable(current_board):
-            current_board = get_new_puzzle(dim)  # Generate a new puzzle if the previous puzzle is not solvable
-        print_board(current_board)
-
-        num_steps = 0  # Number of steps taken by user
+        # Generate and print the game board, with the wanted difficulty if any
+        difficulty = prompt_difficulty(dim) if dim in MAX_DISTANCE else None
+        board = None if difficulty is None else get_puzzle_by_distance(dim, *difficulty)
+        if board is None:
+            if difficulty is not None:
+                print("No puzzle of that difficulty was found, here is a random one.")
+            game = SlidingPuzzle.new_game(dim, keys)
+        else:
+            game = SlidingPuzzle(board, keys)
+        hints = HintProvider(game)  # Starts solving the board in the background
+        print_board(game.board)
 
         # Repeat until board is solved
-        while True:
-            if check_board(current_board):
-                break  # Break out of the loop if current_board is solved
-            move = prompt_moves(current_board)
-            move_tile(current_board, move)  # Do the tile move
-            print_board(current_board)  # Display current_board after doing the move
-            num_steps += 1
+        while not game.is_solved():
+            move = prompt_moves(game)
+            if move == HINT_KEY:
+                hint = hints.get_hint()
+                if hint is None:
+                    print("The hint is not ready yet. Please try again later.")
+                else:
+                    print(f"Hint: press {hint}")
+                continue
+            game.apply_moves(move)  # Do the tile moves
+            hints.on_moves(move)
+            print_board(game.board)  # Display the board once after doing the moves
 
         # Print the final statement with the total number of steps done.
-        print(f"Congratulations! You solved the puzzle in {num_steps} moves!")
+        print(f"Congratulations! You solved the puzzle in {game.steps} moves!")
     
     # Statement after user quits the game
     print("Thank you for playing!")
 
 
-main()
+if __name__ == "__main__":
+    args = parse_arguments()
+    if args.build_pdb:
+        load_distance_table(p_build=True)
+        build_pattern_databases(4)
+    elif args.solve:
+        solve_puzzle_file(args.solve, args.workers, args.blank_first, args.bounded)
+    elif args.replay:
+        replay_file(args.replay)
+    elif args.generate:
+        save_puzzles(args.out, [get_solvable_puzzle(args.dim) for _ in range(args.generate)])
+        print(f"Wrote {args.generate} puzzles to {args.out}")
+    elif args.benchmark_batch:
+        benchmark_batch()
+    elif args.benchmark_difficulty:
+        benchmark_difficulty(3, [(1, 10), (11, 20), (21, 25), (26, 31)])
+        benchmark_difficulty(4, [(1, 20), (21, 35), (36, 45), (46, 50)])
+    elif args.benchmark_sizes:
+        benchmark_sizes()
+    else:
+        main()
@@ -1,5 +1,19 @@
+import argparse
+import math
+import mmap
+import multiprocessing
+import os
+import random
+import struct
+import threading
+import time
 import turtle
 
+try:
+    import numpy as np
+except ImportError:
+    np = None  # NumPy is only needed by the batch functions
+
 # Define constants
 SCREEN_WIDTH = 560
 SCREEN_HEIGHT = 610
@@ -13,15 +27,54 @@ COLOR_OUTLINE = '#F93943'  # Outline color for 4-in-a-row balls
 COLOR_BAR = 'black'  # Tracker fill color
 OUTLINE_WIDTH = 5
 REFRESH_RATE = 100
+SEARCH_POLL_RATE = 20  # ms between checks of the background search of the computer player
+COL_BITS = ROWS + 1  # Bits per column on a bitboard, the top bit of each column always stays empty
+WIN_SHIFTS = (1, COL_BITS, COL_BITS + 1, COL_BITS - 1)  # Bit distance between neighbours: vertical, horizontal, both diagonals
+BOTTOM_MASK = sum(1 << (col*COL_BITS) for col in range(COLS))  # Bottom cell of every column
+BOARD_MASK = BOTTOM_MASK * ((1 << ROWS) - 1)  # Every cell of the board
+CENTER_ORDER = sorted(range(COLS), key=lambda col: abs(2*col - (COLS - 1)))  # Columns from the center outwards
+WIN_SCORE = 1000000  # Score of a won position, plus the number of empty cells left so faster wins score higher
+AI_TIME = 1000  # Time budget of the computer player in ms per move
+TT_SIZE = 1 << 20  # Number of transposition table slots
+UCT_C = 1.4  # Exploration constant of the Monte Carlo tree search
+PARALLEL_TT_SIZE = 1 << 18  # Transposition table slots of each parallel search worker
+# Test positions of the parallel search benchmark, as columns played from the empty board
+BENCHMARK_POSITIONS = ([], [3, 4], [3, 3, 4, 2], [0, 7, 3, 4, 3, 4], [2, 5, 3, 4, 4, 3, 5, 2])
+BOOK_PATH = 'connect4_book.bin'  # Opening book file, built with --build-book
+BOOK_PLIES = 4  # The opening book holds every position with at most this many tokens
+BOOK_DEPTH = 8  # Search depth of the opening book moves
+BOOK_MAGIC = b'C4BK'
+BOOK_HEADER = struct.Struct('>4sBBBx')  # Magic, COLS, ROWS, plies
+BOOK_KEY_BYTES = (COLS*COL_BITS + 7) // 8  # Big-endian keys, so the bytes sort like the numbers
+BOOK_RECORD = struct.Struct(f'>{BOOK_KEY_BYTES}sBi')  # Position key, best column, score
+WINDOW_WEIGHTS = (0, 1, 4, 16)  # Batch score of a line of four cells holding 0-3 tokens of one player and none of the other
+BATCH_ONGOING = -1  # Batch status of a game that has not finished; a won game has the winner, 0 or 1
+BATCH_TIE = 2  # Batch status of a tied game
+RECORD_PATH = 'connect4_games.txt'  # Every finished game is added to this file, one record per line
+RECORD_RESULTS = '12T'  # Record result of a win of player 1, a win of player 2 and a tie
+RECORD_MAGIC = b'C4GR'
+RECORD_HEADER = struct.Struct('>4sBB')  # Magic, COLS, ROWS of a packed record file
+SELFPLAY_CHUNK = 1000  # Games played by a self-play worker per task, each task has its own seed
+SELFPLAY_OPENING = 2  # Random moves at the start of every self-play game, so search players do not repeat one game
+SELFPLAY_DEPTH = 4  # Search depth of the "search" self-play policy
+SELFPLAY_TT_SIZE = 1 << 16  # Transposition table slots of the "search" self-play policy
 
 
 # Define global variables
-g_cursor_x = -999  # Cursor's x position
+g_tracked = (-1, 0)  # Column and player of the highlighted tracker, the column is -1 if none is
 g_column_trackers = []  # Stores the turtle object of each column tracker
-g_game = [[] for _ in range(COLS)]  # Stores the player who owns the token
-g_game_turtle = [[] for _ in range(COLS)]  # Stores the turtle object of each token
-player = 0  # Current player
-scn = turtle.Screen()
+g_game = None  # The Connect4 game on screen
+g_ai = None  # The computer player, or None if both players are human
+g_ai_players = set()  # Players controlled by the computer
+g_search = None  # The running BackgroundSearch of the computer player, or None
+g_token_pens = {}  # Turtle that stamps the tokens of each color, shared by all tokens
+g_book = None  # The opening book of the computer player, or None if there is none
+g_worker_ai = None  # Alpha-beta search of this parallel search worker process
+g_shared_alpha = None  # Best root value found by any parallel search worker
+g_shared_best = None  # Root column of the shared alpha
+g_cancel = None  # Set to stop all parallel search workers
+g_policy_ai = None  # Computer player of the "search" self-play policy in this process
+scn = None  # The screen, only created by init_game so the rules can run without a display
 
 
 # Make column trackers
@@ -36,18 +89,28 @@ def init_rectangle(x, y):
     g_column_trackers.append(tt)
 
 
-# Make new token on specified location and color
-def new_token(x, y, p_color):
-    scn.tracer(0)
-    scn.onclick(None)  # Turn off onclick function temporarily while putting token
-    tt = turtle.Turtle('circle')
-    tt.shapesize(SHAPE_WIDTH)  # Set circle diameter to SHAPE_WIDTH*20px
-    tt.color(p_color)
-    tt.penup()
-    tt.goto(x, y)
-    scn.update()
-    scn.onclick(play_turn)  # Turn on onclick function again
-    return tt
+# Get the turtle that stamps tokens of the color, creating it on first use
+def get_token_pen(p_color):
+    if p_color not in g_token_pens:
+        tt = turtle.Turtle('circle')
+        tt.shapesize(SHAPE_WIDTH)  # Set circle diameter to SHAPE_WIDTH*20px
+        tt.color(p_color)
+        tt.penup()
+        tt.hideturtle()  # Only the stamps are shown
+        g_token_pens[p_color] = tt
+    return g_token_pens[p_color]
+
+
+# Stamp a token on the cell (col, row), optionally with an outline; the caller refreshes the screen
+def draw_token(col, row, p_color, p_outline=None):
+    tt = get_token_pen(p_color)
+    tt.goto(30 + (60 + SPACING) * col, 70 + (60 + SPACING) * row)
+    if p_outline is None:
+        tt.stamp()
+    else:
+        outline(tt, p_outline, OUTLINE_WIDTH)
+        tt.stamp()  # Drawn over the plain stamp of the token
+        outline(tt, p_color, 1)
 
 
 # Create all column trackers
@@ -66,152 +129,1211 @@ def outline(tt, p_color, p_width):
     tt.shapesize(outline=p_width)  # Change the turtle's outline width to p_width
 
 
-# Get mouse x position
+# Get the column under an x position, or -1 if it is outside the board
+def get_column(x):
+    col = int(x // (20*SHAPE_WIDTH + SPACING))
+    if 0 <= col < COLS:
+        return col
+    return -1
+
+
+# Track the column under the mouse
 def motion(event):
-    global g_cursor_x
-    g_cursor_x = event.x
+    update_tracker(get_column(event.x))
 
 
-# Track columns and add outline to the tracker
-def column_tracking():
-    global g_cursor_x
-    
-    col = g_cursor_x // (20*SHAPE_WIDTH + SPACING)  # Determine the column number which the cursor is located
+# Outline the tracker of the column under the mouse in the current player's color
+def update_tracker(col):
+    global g_tracked
     
+    player = g_game.player
+    if g_tracked == (col, player):
+        return  # Nothing changed, e.g. the mouse moved inside the same column
+    old_col = g_tracked[0]
+    g_tracked = (col, player)
+
     # Set color according to current player
     if player == 0:
         color = COLOR_1
     else:
         color = COLOR_2
-    
-    # Change the outline of each tracker
-    for i in range(COLS):
-        tt = g_column_trackers[i]        
-        if i == col:
-            outline(tt, color, OUTLINE_WIDTH)  # Change the tracker's outline when mouse is hovering on top of it
-        else:
-            outline(tt, COLOR_BAR, 1)  # Reset the tracker's outline to default
-    
+
+    # Only the trackers of the old and the new column change
+    if old_col >= 0 and old_col != col:
+        outline(g_column_trackers[old_col], COLOR_BAR, 1)  # Reset the tracker's outline to default
+    if col >= 0:
+        outline(g_column_trackers[col], color, OUTLINE_WIDTH)  # Change the tracker's outline when mouse is hovering on top of it
     scn.update()
-    scn.ontimer(column_tracking, REFRESH_RATE)
 
-    return col
 
+# Get the bit of the cell on a bitboard
+def cell_bit(col, row):
+    return 1 << (col*COL_BITS + row)
 
-# Check whether the current player has won the game
-def check_game():
-    # Returns -1 if the game has not finished yet
-    # Returns 0 if the game is tied
-    # Returns 1 if the player has won
-    
-    global g_game, player
-    
-    # Check vertically
-    for i in range(COLS):
-        num_token = len(g_game[i])
+
+# Drop a token of the player into a column and return the row it lands on
+def drop_token(boards, heights, col, p_player):
+    row = heights[col]
+    boards[p_player] |= cell_bit(col, row)
+    heights[col] += 1
+    return row
+
+
+# Get the (col, row) cells of a four in a row through the cell on a bitboard, or None if there is none
+def winning_line(board, col, row):
+    bit = col*COL_BITS + row
+    for shift in WIN_SHIFTS:
+        # Count at most 3 tokens each way; the empty top bits stop the count at the board edges
+        back = 0
+        i = bit - shift
+        while back < 3 and i >= 0 and board >> i & 1:
+            back += 1
+            i -= shift
+        forward = 0
+        i = bit + shift
+        while forward < 3 and board >> i & 1:
+            forward += 1
+            i += shift
+        if back + forward >= 3:
+            start = bit - (back - min(back, back + forward - 3))*shift  # A window of four that includes the new token
+            return [divmod(start + k*shift, COL_BITS) for k in range(4)]
+    return None
+
+
+# Game state and rules of Connect 4, without any drawing
+class Connect4:
+    def __init__(self):
+        self.boards = [0, 0]  # Bitboard of each player, the cell (col, row) is bit col*COL_BITS + row
+        self.heights = [0] * COLS  # Number of tokens in each column
+        self.filled = 0  # Number of tokens on the board
+        self.player = 0  # Player to move
+        self.moves = []  # Columns played so far
+
+    # Check whether a token can be dropped into the column
+    def can_play(self, col):
+        return 0 <= col < COLS and self.heights[col] < ROWS
+
+    # Get an independent copy of the game
+    def copy(self):
+        game = Connect4()
+        game.boards = list(self.boards)
+        game.heights = list(self.heights)
+        game.filled = self.filled
+        game.player = self.player
+        game.moves = list(self.moves)
+        return game
+
+    # Get the columns that are not full
+    def legal_moves(self):
+        heights = self.heights
+        return [col for col in range(COLS) if heights[col] < ROWS]
+
+    # Get the (col, row) cells of the four in a row the last move made, or None
+    def winning_cells(self):
+        col = self.moves[-1]
+        return winning_line(self.boards[1 - self.player], col, self.heights[col] - 1)
+
+    # Drop the current player's token into the column and pass the turn
+    def play(self, col):
+        # Returns -1 if the game has not finished yet
+        # Returns 0 if the game is tied
+        # Returns 1 if the player has won
+        
+        row = drop_token(self.boards, self.heights, col, self.player)
+        self.filled += 1
+        self.moves.append(col)
+        won = winning_line(self.boards[self.player], col, row) is not None  # Only lines through the new token can have changed
+        self.player = 1 - self.player
+        if won:
+            return 1
+        # Check for tie
+        if self.filled == COLS*ROWS:
+            return 0
+        return -1
+
+
+# Get the empty cells that would complete four in a row for the player
+def threats(board, mask):
+    # Vertical: three tokens right below the cell
+    found = (board << 1) & (board << 2) & (board << 3)
+    for shift in WIN_SHIFTS[1:]:
+        # The cell can be at either end of the line or in one of the two gaps
+        pair = (board << shift) & (board << 2*shift)
+        found |= pair & (board << 3*shift)
+        found |= pair & (board >> shift)
+        pair = (board >> shift) & (board >> 2*shift)
+        found |= pair & (board << shift)
+        found |= pair & (board >> 3*shift)
+    return found & BOARD_MASK & ~mask
+
+
+# Score a position for the player to move without searching, from the number of threats of each player
+def evaluate(own, other):
+    mask = own | other
+    return threats(own, mask).bit_count() - threats(other, mask).bit_count()
+
+
+# Raised inside a search when its time budget is used up or it is cancelled
+class SearchTimeout(Exception):
+    pass
+
+
+# Choose a column for the player to move (own) with iterative deepening, shared by the alpha-beta players
+# search(own, other, heights, depth, order) searches the root columns in order to a depth and returns
+# (best column, its value), or raises SearchTimeout; ai.get_stats(depth, value, start) describes the search
+# on_progress(column, stats) is called after every finished depth
+# Returns the column of the deepest finished depth and a dict of search statistics
+def iterative_deepening(ai, search, own, other, heights, start, on_progress=None):
+    order = [col for col in CENTER_ORDER if heights[col] < ROWS]
+    best_col, best_value, depth_done = order[0], 0, 0
+
+    mask = own | other
+    empty = COLS*ROWS - mask.bit_count()
+    wins = [col for col in order if threats(own, mask) & cell_bit(col, heights[col])]
+    if wins:
+        best_col, best_value, depth_done = wins[0], WIN_SCORE + empty - 1, 1
+        empty = 0  # No need to search
+    if ai.max_depth is not None:
+        empty = min(empty, ai.max_depth)
+    for depth in range(1, empty + 1):
         try:
-            for j in range(num_token-3):
-                if (g_game[i][j] == player and 
-                        g_game[i][j+1] == player and 
-                        g_game[i][j+2] == player and 
-                        g_game[i][j+3] == player):
-                    for k in range(4):
-                        outline(g_game_turtle[i][j+k], COLOR_OUTLINE, OUTLINE_WIDTH)
-                    return 1
-        except:
-            continue
-    # Check horizontally
-    for j in range(ROWS):
-        for i in range(COLS-3):
-            try:
-                if (g_game[i][j] == player and
-                        g_game[i+1][j] == player and
-                        g_game[i+2][j] == player and
-                        g_game[i+3][j] == player):
-                    for k in range(4):
-                        outline(g_game_turtle[i+k][j], COLOR_OUTLINE, OUTLINE_WIDTH)
-                    return 1
-            except:
+            col, value = search(own, other, heights, depth, order)
+        except SearchTimeout:
+            break
+        best_col, best_value, depth_done = col, value, depth
+        order = [col] + [c for c in order if c != col]  # Search the best column first next time
+        if on_progress is not None:
+            on_progress(best_col, ai.get_stats(depth_done, best_value, start))
+        if abs(value) > WIN_SCORE:
+            break  # The result is decided
+
+    return best_col, ai.get_stats(depth_done, best_value, start)
+
+
+# Get the statistics shared by the alpha-beta players of a search started at start
+def search_stats(depth, value, nodes, start):
+    seconds = time.perf_counter() - start
+    return {
+        "depth": depth,
+        "value": value,
+        "nodes": nodes,
+        "seconds": seconds,
+        "nodes_per_sec": nodes / seconds if seconds > 0 else 0.0,
+    }
+
+
+# Computer player: negamax with alpha-beta pruning, a transposition table and iterative deepening
+class AlphaBetaAI:
+    # Transposition table entry flags: the stored value is exact, a lower bound or an upper bound
+    EXACT, LOWER, UPPER = 0, 1, 2
+
+    def __init__(self, time_budget=AI_TIME, tt_size=TT_SIZE, max_depth=None):
+        self.time_budget = time_budget  # ms per move, or None for no limit
+        self.max_depth = max_depth  # Deepest search, or None for no limit
+        self.tt_size = tt_size
+        # Slot key % tt_size holds (key, depth, flag, value, best column, generation) or None
+        self.tt = [None] * tt_size
+        self.generation = 0  # Incremented every move, so entries of old searches get replaced first
+        self.deadline = None
+        self.cancel = threading.Event()  # Stops the search when set, shared by the workers of a parallel search
+        self.nodes = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+
+    # Store a search result; a slot is replaced if it is empty, from an older move or not searched deeper
+    def store(self, key, depth, flag, value, col):
+        slot = key % self.tt_size
+        entry = self.tt[slot]
+        if entry is None or entry[5] != self.generation or depth >= entry[1]:
+            self.tt[slot] = (key, depth, flag, value, col, self.generation)
+
+    # Search a position and return its value for the player to move (own)
+    def negamax(self, own, other, heights, depth, alpha, beta):
+        self.nodes += 1
+        if self.nodes & 1023 == 0 and (time.perf_counter() > self.deadline or self.cancel.is_set()):
+            raise SearchTimeout
+        mask = own | other
+        empty = COLS*ROWS - mask.bit_count()
+
+        # Win right away if possible
+        playable = (mask + BOTTOM_MASK) & BOARD_MASK  # Lowest empty cell of every column
+        if threats(own, mask) & playable:
+            return WIN_SCORE + empty - 1
+        if empty == 0:
+            return 0  # Tie
+        if depth == 0:
+            return evaluate(own, other)
+
+        # Probe the transposition table
+        key = own + mask  # Unique for the position, see the top bit of every column
+        self.tt_probes += 1
+        entry = self.tt[key % self.tt_size]
+        first = None
+        if entry is not None and entry[0] == key:
+            self.tt_hits += 1
+            first = entry[4]
+            if entry[1] >= depth:
+                flag, value = entry[2], entry[3]
+                if flag == AlphaBetaAI.EXACT:
+                    return value
+                if flag == AlphaBetaAI.LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value
+
+        # Search the best move of the last search first, then from the center outwards
+        order = CENTER_ORDER if first is None else [first] + [col for col in CENTER_ORDER if col != first]
+        alpha_start = alpha
+        best_value = -WIN_SCORE*2
+        best_col = None
+        for col in order:
+            row = heights[col]
+            if row >= ROWS:
                 continue
-    # Check increasing diagonal
-    for i in range(COLS-3):
-        for j in range(ROWS-3):
-            try:
-                if (g_game[i][j] == player and
-                        g_game[i+1][j+1] == player and
-                        g_game[i+2][j+2] == player and
-                        g_game[i+3][j+3] == player):
-                    for k in range(4):
-                        outline(g_game_turtle[i+k][j+k], COLOR_OUTLINE, OUTLINE_WIDTH)
-                    return 1
-            except:
+            heights[col] += 1
+            value = -self.negamax(other, own | cell_bit(col, row), heights, depth - 1, -beta, -alpha)
+            heights[col] -= 1
+            if value > best_value:
+                best_value = value
+                best_col = col
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= alpha_start:
+            flag = AlphaBetaAI.UPPER
+        elif best_value >= beta:
+            flag = AlphaBetaAI.LOWER
+        else:
+            flag = AlphaBetaAI.EXACT
+        self.store(key, depth, flag, best_value, best_col)
+        return best_value
+
+    # Search each column at the root and return (best column, its value)
+    def search_root(self, own, other, heights, depth, order):
+        alpha = -WIN_SCORE*2
+        best_col = None
+        for col in order:
+            row = heights[col]
+            heights[col] += 1
+            value = -self.negamax(other, own | cell_bit(col, row), heights, depth - 1, -WIN_SCORE*2, -alpha)
+            heights[col] -= 1
+            if best_col is None or value > alpha:
+                alpha = value
+                best_col = col
+        return best_col, alpha
+
+    # Choose a column for the player to move (own) with iterative deepening under the time budget
+    # on_progress(column, stats) is called after every finished depth
+    # Returns the column and a dict of search statistics
+    def choose_move(self, own, other, heights, on_progress=None):
+        start = time.perf_counter()
+        self.deadline = float('inf') if self.time_budget is None else start + self.time_budget / 1000
+        self.cancel.clear()
+        self.generation += 1
+        self.nodes = self.tt_probes = self.tt_hits = 0
+        heights = list(heights)  # A timeout leaves the heights of the aborted search behind
+        return iterative_deepening(self, self.search_root, own, other, heights, start, on_progress)
+
+    # Get the statistics of the search started at start
+    def get_stats(self, depth, value, start):
+        stats = search_stats(depth, value, self.nodes, start)
+        stats["tt_hit_rate"] = self.tt_hits / self.tt_probes if self.tt_probes else 0.0
+        return stats
+
+    # Stop the running search, it returns the move of the last finished depth; called from another thread
+    def stop(self):
+        self.cancel.set()
+
+    def close(self):
+        pass  # Nothing to release, the search runs in this process
+
+    # Describe the search statistics of a move
+    def report(self, stats):
+        return (f'depth {stats["depth"]}, {stats["nodes_per_sec"]:.0f} nodes/sec, '
+                f'TT hit rate {stats["tt_hit_rate"]:.1%}')
+
+
+# Set up a parallel search worker process with the bounds shared by all workers
+def init_search_worker(shared_alpha, shared_best, cancel, tt_size):
+    global g_worker_ai, g_shared_alpha, g_shared_best, g_cancel
+    g_shared_alpha = shared_alpha
+    g_shared_best = shared_best
+    g_cancel = cancel
+    g_worker_ai = AlphaBetaAI(None, tt_size)
+    g_worker_ai.deadline = float('inf')  # Workers only stop when cancelled
+    g_worker_ai.cancel = cancel
+
+
+# Search one root column in a parallel search worker and return (value, nodes), the value is None if cancelled
+# The opponent's replies are searched here one by one, so the window narrows as other workers raise the alpha
+def search_root_move(task):
+    own, other, heights, col, depth = task
+    ai = g_worker_ai
+    ai.nodes = 0
+    ai.generation += 1
+    heights = list(heights)
+    own |= cell_bit(col, heights[col])
+    heights[col] += 1
+    mask = own | other
+    empty = COLS*ROWS - mask.bit_count()
+
+    # Look at the position from the opponent, who moves next
+    playable = (mask + BOTTOM_MASK) & BOARD_MASK
+    if threats(other, mask) & playable:
+        reply_value = WIN_SCORE + empty - 1
+    elif empty == 0:
+        reply_value = 0
+    elif depth == 1:
+        reply_value = evaluate(other, own)
+    else:
+        reply_value = -WIN_SCORE*2
+        try:
+            for reply in CENTER_ORDER:
+                row = heights[reply]
+                if row >= ROWS:
+                    continue
+                beta = -g_shared_alpha.value  # The opponent only needs to hold the root below the best so far
+                if reply_value >= beta:
+                    break
+                heights[reply] += 1
+                value = -ai.negamax(own, other | cell_bit(reply, row), heights, depth - 2, -beta, -reply_value)
+                heights[reply] -= 1
+                reply_value = max(reply_value, value)
+        except SearchTimeout:
+            return None, ai.nodes
+
+    value = -reply_value
+    with g_shared_alpha.get_lock():
+        if value > g_shared_alpha.value:
+            g_shared_alpha.value = value
+            g_shared_best.value = col
+    return value, ai.nodes
+
+
+# Computer player: alpha-beta search with the root columns split across worker processes
+# The first column is searched alone to get a good alpha (young brothers wait), then the rest in parallel
+class ParallelAlphaBetaAI:
+    def __init__(self, time_budget=AI_TIME, workers=None, max_depth=None, tt_size=PARALLEL_TT_SIZE):
+        self.time_budget = time_budget  # ms per move, or None for no limit
+        self.workers = workers or multiprocessing.cpu_count()
+        self.max_depth = max_depth  # Deepest search, or None for no limit
+        self.deadline = None
+        self.nodes = 0
+        self.alpha = multiprocessing.Value('q', 0)
+        self.best = multiprocessing.Value('i', -1)
+        self.cancel = multiprocessing.Event()
+        self.stopped = threading.Event()
+        self.pool = multiprocessing.Pool(self.workers, init_search_worker,
+                                         (self.alpha, self.best, self.cancel, tt_size))
+
+    # Search every root column to a depth and return (best column, its value), adding the nodes to self.nodes
+    # Raises SearchTimeout if the deadline passed or the search was stopped first
+    def search_depth(self, own, other, heights, depth, order):
+        if self.stopped.is_set():
+            raise SearchTimeout
+        self.alpha.value = -WIN_SCORE*2
+        self.best.value = -1
+        self.cancel.clear()
+        tasks = [(own, other, heights, col, depth) for col in order]
+        timeout = None if self.deadline is None else max(0.0, self.deadline - time.perf_counter())
+
+        # The eldest brother first
+        first = self.pool.apply_async(search_root_move, (tasks[0],))
+        first.wait(timeout)
+        if not first.ready() or self.stopped.is_set():
+            self.cancel.set()
+            self.nodes += first.get()[1]
+            raise SearchTimeout
+        self.nodes += first.get()[1]
+
+        # Then the younger brothers in parallel, cancelled together when the deadline passes
+        rest = self.pool.map_async(search_root_move, tasks[1:], chunksize=1)
+        timeout = None if self.deadline is None else max(0.0, self.deadline - time.perf_counter())
+        rest.wait(timeout)
+        if not rest.ready() or self.stopped.is_set():
+            self.cancel.set()
+            self.nodes += sum(count for _, count in rest.get())
+            raise SearchTimeout
+        self.nodes += sum(count for _, count in rest.get())
+        return self.best.value, self.alpha.value
+
+    # Choose a column for the player to move (own) with iterative deepening under the time budget
+    # on_progress(column, stats) is called after every finished depth
+    # Returns the column and a dict of search statistics
+    def choose_move(self, own, other, heights, on_progress=None):
+        start = time.perf_counter()
+        self.deadline = None if self.time_budget is None else start + self.time_budget / 1000
+        self.stopped.clear()
+        self.nodes = 0
+        return iterative_deepening(self, self.search_depth, own, other, heights, start, on_progress)
+
+    # Get the statistics of the search started at start
+    def get_stats(self, depth, value, start):
+        stats = search_stats(depth, value, self.nodes, start)
+        stats["workers"] = self.workers
+        return stats
+
+    # Stop the running search, it returns the move of the last finished depth; called from another thread
+    def stop(self):
+        self.stopped.set()
+        self.cancel.set()
+
+    # Describe the search statistics of a move
+    def report(self, stats):
+        return (f'depth {stats["depth"]}, {stats["nodes_per_sec"]:.0f} nodes/sec '
+                f'on {stats["workers"]} workers')
+
+    def close(self):
+        self.cancel.set()
+        self.pool.terminate()
+
+
+# Measure the speedup of the parallel search over one worker at a fixed depth on the test positions
+def benchmark_parallel(depth, workers=None):
+    workers = workers or multiprocessing.cpu_count()
+    searches = {1: ParallelAlphaBetaAI(None, 1, depth), workers: ParallelAlphaBetaAI(None, workers, depth)}
+    print(f'position                    1 worker   {workers} workers    speedup   column   value')
+    totals = {count: 0.0 for count in searches}
+    for ai in searches.values():
+        ai.search_depth(0, 0, [0] * COLS, 1, CENTER_ORDER)  # Start the worker processes before timing
+    for moves in BENCHMARK_POSITIONS:
+        game = Connect4()
+        for col in moves:
+            game.play(col)
+        own, other = game.boards[game.player], game.boards[1 - game.player]
+        results = {}
+        for count, ai in searches.items():
+            results[count] = ai.choose_move(own, other, game.heights)
+            totals[count] += results[count][1]["seconds"]
+        col, stats = results[workers]
+        one = results[1][1]["seconds"]
+        name = ''.join(str(col + 1) for col in moves) or 'empty'
+        print(f'{name:24s} {one:10.2f}s {stats["seconds"]:10.2f}s {one / stats["seconds"]:9.2f}x '
+              f'{col + 1:8d} {stats["value"]:7d}')
+    print(f'{"total":24s} {totals[1]:10.2f}s {totals[workers]:10.2f}s {totals[1] / totals[workers]:9.2f}x')
+    for ai in searches.values():
+        ai.close()
+
+
+# Node of the Monte Carlo search tree
+class MCTSNode:
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'wins')
+
+    def __init__(self, move, parent, untried):
+        self.move = move  # Column played to reach the node
+        self.parent = parent
+        self.children = []
+        self.untried = untried  # Columns not expanded yet, empty once the game has ended
+        self.visits = 0
+        self.wins = 0.0  # Wins of the player who played move, a tie counts half
+
+    # Get the child with the highest upper confidence bound (UCT)
+    def select(self):
+        log_visits = math.log(self.visits)
+        return max(self.children,
+                   key=lambda child: child.wins / child.visits + UCT_C * math.sqrt(log_visits / child.visits))
+
+
+# Run a Monte Carlo tree search from a position for a time budget in a worker process
+# Returns the {column: (visits, wins)} of the root moves and the number of rollouts
+def mcts_search(task):
+    boards, heights, time_budget, seed = task
+    rng = random.Random(seed)
+    root_game = Connect4()
+    root_game.boards = list(boards)
+    root_game.heights = list(heights)
+    root_game.filled = sum(heights)
+    root = MCTSNode(None, None, root_game.legal_moves())
+    deadline = time.perf_counter() + time_budget / 1000
+    rollouts = 0
+
+    while time.perf_counter() < deadline:
+        game = root_game.copy()
+        node = root
+        result = -1
+
+        # Selection: follow the best children while the nodes are fully expanded
+        while not node.untried and node.children:
+            node = node.select()
+            result = game.play(node.move)
+
+        # Expansion: add one untried move
+        if node.untried and result < 0:
+            col = node.untried.pop(rng.randrange(len(node.untried)))
+            result = game.play(col)
+            child = MCTSNode(col, node, game.legal_moves() if result < 0 else [])
+            node.children.append(child)
+            node = child
+
+        # Rollout: play random moves until the game ends
+        mover = 1 - game.player  # The player who moved into node
+        while result < 0:
+            moves = game.legal_moves()
+            result = game.play(moves[rng.randrange(len(moves))])
+        winner = 1 - game.player if result == 1 else -1
+        rollouts += 1
+
+        # Backpropagation: score each node for the player who moved into it
+        while node is not None:
+            node.visits += 1
+            if winner == mover:
+                node.wins += 1
+            elif winner < 0:
+                node.wins += 0.5
+            mover = 1 - mover
+            node = node.parent
+
+    return {child.move: (child.visits, child.wins) for child in root.children}, rollouts
+
+
+# Computer player: Monte Carlo tree search with UCT, one independent tree per worker process (root parallel)
+class MCTSAI:
+    def __init__(self, time_budget=AI_TIME, workers=1, seed=None):
+        self.time_budget = time_budget  # ms per move
+        self.workers = workers
+        self.rng = random.Random(seed)
+        self.pool = multiprocessing.Pool(workers) if workers > 1 else None
+        self.stopped = threading.Event()
+
+    # Choose a column for the player to move (own) by the visits summed over all trees
+    # on_progress is accepted like the other players, but the trees are only combined at the end
+    # Returns the column and a dict of search statistics
+    def choose_move(self, own, other, heights, on_progress=None):
+        start = time.perf_counter()
+        self.stopped.clear()
+        tasks = [((own, other), heights, self.time_budget, self.rng.getrandbits(64)) for _ in range(self.workers)]
+        if self.pool is None:
+            results = [mcts_search(tasks[0])]
+        else:
+            pending = self.pool.map_async(mcts_search, tasks)
+            while not pending.ready():
+                pending.wait(SEARCH_POLL_RATE / 1000)
+                if self.stopped.is_set():
+                    return None, {}  # Abandon the workers, they finish on their own
+            results = pending.get()
+        seconds = time.perf_counter() - start
+
+        totals = {}
+        for moves, _ in results:
+            for col, (visits, wins) in moves.items():
+                old = totals.get(col, (0, 0.0))
+                totals[col] = (old[0] + visits, old[1] + wins)
+        best_col = max(totals, key=lambda col: totals[col][0])
+        rollouts = [count for _, count in results]
+        stats = {
+            "rollouts": sum(rollouts),
+            "seconds": seconds,
+            "rollouts_per_sec": sum(rollouts) / seconds if seconds > 0 else 0.0,
+            "workers": self.workers,
+            # Rollouts of all workers compared with every worker doing as many as the busiest one.
+            # This only shows how evenly the work was spread, benchmark_mcts measures the speedup.
+            "balance": sum(rollouts) / (self.workers * max(rollouts)) if max(rollouts) else 0.0,
+            "win_rate": totals[best_col][1] / totals[best_col][0],
+        }
+        return best_col, stats
+
+    # Describe the search statistics of a move
+    def report(self, stats):
+        return (f'{stats["rollouts"]} rollouts, {stats["rollouts_per_sec"]:.0f} rollouts/sec on '
+                f'{stats["workers"]} workers ({stats["balance"]:.0%} load balance), '
+                f'win rate {stats["win_rate"]:.1%}')
+
+    # Stop waiting for the running search; called from another thread
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+
+
+# Measure how the Monte Carlo tree search scales with the number of worker processes
+# Parallel efficiency is the speedup over the measured single worker divided by the number of workers
+def benchmark_mcts(time_budget=AI_TIME, max_workers=None, seed=0):
+    max_workers = max_workers or multiprocessing.cpu_count()
+    game = Connect4()
+    for col in [3, 4, 3, 4]:  # An early middle game position
+        game.play(col)
+    own, other = game.boards[game.player], game.boards[1 - game.player]
+
+    print('workers    rollouts/sec    speedup    efficiency    best column')
+    base = None
+    workers = 1
+    while workers <= max_workers:
+        ai = MCTSAI(time_budget, workers, seed)
+        ai.choose_move(own, other, game.heights)  # Warm up the worker processes
+        col, stats = ai.choose_move(own, other, game.heights)
+        ai.close()
+        base = base or stats["rollouts_per_sec"]
+        speedup = stats["rollouts_per_sec"] / base
+        print(f'{workers:7d} {stats["rollouts_per_sec"]:15.0f} {speedup:9.2f}x {speedup / workers:13.0%} '
+              f'{col + 1:14d}')
+        workers *= 2
+
+
+# Self-play policy: a random column
+def random_policy(game, rng):
+    return rng.choice(game.legal_moves())
+
+
+# Self-play policy: win if possible, otherwise block the opponent's win, otherwise a random column
+# that does not let the opponent win on top of it
+def greedy_policy(game, rng):
+    own, other = game.boards[game.player], game.boards[1 - game.player]
+    mask = own | other
+    playable = (mask + BOTTOM_MASK) & BOARD_MASK
+    for board in (own, other):
+        found = threats(board, mask) & playable
+        if found:
+            return ((found & -found).bit_length() - 1) // COL_BITS
+    moves = game.legal_moves()
+    safe = [col for col in moves if not threats(other, mask) & cell_bit(col, game.heights[col] + 1)]
+    return rng.choice(safe or moves)
+
+
+# Self-play policy: the alpha-beta computer player at a fixed depth
+def search_policy(game, rng):
+    global g_policy_ai
+    if g_policy_ai is None:
+        g_policy_ai = AlphaBetaAI(None, SELFPLAY_TT_SIZE, SELFPLAY_DEPTH)
+    col, _ = g_policy_ai.choose_move(game.boards[game.player], game.boards[1 - game.player], game.heights)
+    return col
+
+
+POLICIES = {'random': random_policy, 'greedy': greedy_policy, 'search': search_policy}
+
+
+# Play one game between two policies and return the winner (0 or 1, -1 if tied) and the number of moves
+def play_game(policies, rng):
+    game = Connect4()
+    while True:
+        if game.filled < SELFPLAY_OPENING:
+            col = random_policy(game, rng)
+        else:
+            col = policies[game.player](game, rng)
+        player = game.player
+        result = game.play(col)
+        if result >= 0:
+            return (player if result == 1 else -1), game.filled
+
+
+# Play a chunk of self-play games in a worker process, the two policies switch sides every game
+def selfplay_chunk(task):
+    global g_policy_ai
+    names, seed, count = task
+    rng = random.Random(seed)
+    g_policy_ai = None  # A fresh transposition table keeps every chunk reproducible
+    policies = [POLICIES[name] for name in names]
+    counts = [0, 0, 0, 0, 0]  # Wins of each policy, ties, wins of the first player, moves
+    for i in range(count):
+        side = i % 2  # The player the first policy plays
+        winner, moves = play_game(policies if side == 0 else policies[::-1], rng)
+        if winner < 0:
+            counts[2] += 1
+        else:
+            counts[winner ^ side] += 1
+            counts[3] += winner == 0
+        counts[4] += moves
+    return counts
+
+
+# Play many games between two policies across worker processes and print the results
+def run_selfplay(games, names, workers, seed):
+    # Tasks and their seeds only depend on the seed and the number of games, not on the workers
+    rng = random.Random(seed)
+    tasks = []
+    for start in range(0, games, SELFPLAY_CHUNK):
+        tasks.append((names, rng.getrandbits(64), min(SELFPLAY_CHUNK, games - start)))
+
+    counts = [0, 0, 0, 0, 0]
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        for result in pool.imap_unordered(selfplay_chunk, tasks):
+            counts = [a + b for a, b in zip(counts, result)]
+    seconds = time.perf_counter() - start
+
+    print(f'{games} games of {names[0]} against {names[1]} on {COLS}x{ROWS} '
+          f'with {workers} workers in {seconds:.2f}s ({games / seconds:.0f} games/sec)')
+    print(f'{names[0]} wins {counts[0] / games:.1%}, {names[1]} wins {counts[1] / games:.1%}, '
+          f'ties {counts[2] / games:.1%}, first player wins {counts[3] / games:.1%}, '
+          f'{counts[4] / games:.1f} moves per game')
+    return counts
+
+
+# Mirror a bitboard left to right
+def mirror(board):
+    column = (1 << COL_BITS) - 1
+    mirrored = 0
+    for col in range(COLS):
+        mirrored |= ((board >> (col*COL_BITS)) & column) << ((COLS - 1 - col)*COL_BITS)
+    return mirrored
+
+
+# Get the opening book key of a position and whether it is the mirrored one
+# The key is the smaller of the position and its mirror image, so both share one record
+def book_key(own, other):
+    mask = own | other
+    key = own + mask  # Unique for the position, see the top bit of every column
+    mirrored = mirror(own) + mirror(mask)
+    if mirrored < key:
+        return mirrored, True
+    return key, False
+
+
+# Opening book file: a header and the records sorted by key, searched in place through a memory map
+class OpeningBook:
+    def __init__(self, path=BOOK_PATH):
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, cols, rows, self.plies = BOOK_HEADER.unpack_from(self.data)
+        if magic != BOOK_MAGIC or (cols, rows) != (COLS, ROWS):
+            self.data.close()
+            raise ValueError(f'{path} is not an opening book for a {COLS}x{ROWS} board')
+        self.count = (len(self.data) - BOOK_HEADER.size) // BOOK_RECORD.size
+
+    # Get the (column, score) of the book move of a position, or None if it is not in the book
+    def lookup(self, own, other):
+        key, mirrored = book_key(own, other)
+        target = key.to_bytes(BOOK_KEY_BYTES, 'big')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            offset = BOOK_HEADER.size + middle*BOOK_RECORD.size
+            found = self.data[offset:offset + BOOK_KEY_BYTES]
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                _, col, score = BOOK_RECORD.unpack_from(self.data, offset)
+                return (COLS - 1 - col if mirrored else col), score
+        return None
+
+    def close(self):
+        self.data.close()
+
+
+# Load the opening book if it has been built
+def load_opening_book(path=BOOK_PATH):
+    if not os.path.exists(path):
+        return None
+    try:
+        return OpeningBook(path)
+    except ValueError as error:
+        print(error)
+        return None
+
+
+# Search every position with at most plies tokens and write the best moves to an opening book file
+def build_opening_book(path=BOOK_PATH, plies=BOOK_PLIES, depth=BOOK_DEPTH):
+    # Collect the positions that are not decided yet, one of each mirror pair, as seen from their key
+    positions = {}
+    stack = [Connect4()]
+    while stack:
+        game = stack.pop()
+        own, other = game.boards[game.player], game.boards[1 - game.player]
+        key, mirrored = book_key(own, other)
+        if key in positions:
+            continue
+        positions[key] = (mirror(own), mirror(other)) if mirrored else (own, other)
+        if game.filled == plies:
+            continue
+        for col in game.legal_moves():
+            child = game.copy()
+            if child.play(col) < 0:
+                stack.append(child)
+
+    # Search them; the stored sides are already oriented like the key, so no column needs mirroring
+    ai = AlphaBetaAI(None, TT_SIZE, depth)
+    records = []
+    start = time.perf_counter()
+    for i, key in enumerate(sorted(positions)):
+        own, other = positions[key]
+        mask = own | other
+        heights = [((mask >> (col*COL_BITS)) & ((1 << COL_BITS) - 1)).bit_length() for col in range(COLS)]
+        col, stats = ai.choose_move(own, other, heights)
+        records.append(BOOK_RECORD.pack(key.to_bytes(BOOK_KEY_BYTES, 'big'), col, stats['value']))
+        if (i + 1) % 100 == 0:
+            print(f'{i + 1}/{len(positions)} positions searched in {time.perf_counter() - start:.0f}s')
+
+    with open(path, 'wb') as f:
+        f.write(BOOK_HEADER.pack(BOOK_MAGIC, COLS, ROWS, plies))
+        f.write(b''.join(records))  # Already sorted by key
+    print(f'Wrote {len(records)} positions up to {plies} plies to {path} '
+          f'in {time.perf_counter() - start:.0f}s')
+
+
+# Stop with a message if NumPy is not installed
+def require_numpy():
+    if np is None:
+        raise SystemExit('The batch functions need NumPy, install it with: pip install numpy')
+
+
+# Get the offsets of the cells of every line of four on the board, as (start column, start row) ranges
+# and the step (dc, dr) of each of the four directions
+def get_line_directions():
+    return [
+        ((0, COLS), (0, ROWS - 3), (0, 1)),  # Vertical
+        ((0, COLS - 3), (0, ROWS), (1, 0)),  # Horizontal
+        ((0, COLS - 3), (0, ROWS - 3), (1, 1)),  # Increasing diagonal
+        ((0, COLS - 3), (3, ROWS), (1, -1)),  # Decreasing diagonal
+    ]
+
+
+# Convert games to an (N, COLS, ROWS) int8 array, indexed [game, col, row]: the player 0 or 1 on each cell, -1 if empty
+def games_to_array(games):
+    require_numpy()
+    boards = np.full((len(games), COLS, ROWS), -1, dtype=np.int8)
+    for i, game in enumerate(games):
+        for player in (0, 1):
+            for col in range(COLS):
+                for row in range(game.heights[col]):
+                    if game.boards[player] & cell_bit(col, row):
+                        boards[i, col, row] = player
+    return boards
+
+
+# Get the status and score of one board, given as nested lists board[col][row], the scalar version of evaluate_batch
+def evaluate_cells(board):
+    counts = [[0] * (COLS*ROWS) for _ in range(2)]  # Lines by number of tokens, for each player
+    wins = [False, False]
+    for (c0, c1), (r0, r1), (dc, dr) in get_line_directions():
+        for c in range(c0, c1):
+            for r in range(r0, r1):
+                tokens = [board[c + k*dc][r + k*dr] for k in range(4)]
+                for player in (0, 1):
+                    own = tokens.count(player)
+                    if own == 4:
+                        wins[player] = True
+                    elif own + tokens.count(-1) == 4:
+                        counts[player][own] += 1  # The other player has no token on the line
+    if wins[0] or wins[1]:
+        status = 0 if wins[0] else 1
+        return status, WIN_SCORE if status == 0 else -WIN_SCORE
+    score = sum(WINDOW_WEIGHTS[n] * (counts[0][n] - counts[1][n]) for n in range(4))
+    if all(cell >= 0 for column in board for cell in column):
+        return BATCH_TIE, score
+    return BATCH_ONGOING, score
+
+
+# Get the status and score of a batch of boards at once
+# boards is an (N, COLS, ROWS) int8 array, see games_to_array; returns two length N arrays:
+# the status (the winner 0 or 1, BATCH_TIE or BATCH_ONGOING; 0 if both players have four in a row)
+# and the score for player 0 (WIN_SCORE or -WIN_SCORE if won, otherwise the weights of the open lines)
+def evaluate_batch(boards):
+    require_numpy()
+    players = [(boards == player).astype(np.int8) for player in (0, 1)]
+    weights = np.array(WINDOW_WEIGHTS + (0,), dtype=np.int32)
+    wins = [np.zeros(len(boards), dtype=bool) for _ in (0, 1)]
+    score = np.zeros(len(boards), dtype=np.int32)
+
+    # Count the tokens of each player on every line of four with sliding windows
+    for (c0, c1), (r0, r1), (dc, dr) in get_line_directions():
+        counts = []
+        for tokens in players:
+            count = sum(tokens[:, c0 + k*dc:c1 + k*dc, r0 + k*dr:r1 + k*dr] for k in range(4))
+            counts.append(count.reshape(len(boards), -1))
+        for player in (0, 1):
+            wins[player] |= (counts[player] == 4).any(axis=1)
+        score += (weights[counts[0]] * (counts[1] == 0)).sum(axis=1, dtype=np.int32)
+        score -= (weights[counts[1]] * (counts[0] == 0)).sum(axis=1, dtype=np.int32)
+
+    full = (boards >= 0).all(axis=(1, 2))
+    status = np.where(full, BATCH_TIE, BATCH_ONGOING).astype(np.int8)
+    status[wins[1]] = 1
+    status[wins[0]] = 0
+    score[wins[1]] = -WIN_SCORE
+    score[wins[0]] = WIN_SCORE
+    return status, score
+
+
+# Get random boards for the batch benchmark, the tokens are random so the boards are not all reachable in a game
+def get_random_boards(count, seed=0):
+    require_numpy()
+    rng = np.random.default_rng(seed)
+    heights = rng.integers(0, ROWS + 1, (count, COLS, 1))
+    tokens = rng.integers(0, 2, (count, COLS, ROWS), dtype=np.int8)
+    return np.where(np.arange(ROWS) < heights, tokens, -1).astype(np.int8)
+
+
+# Compare the speed of evaluate_batch with the scalar loop of evaluate_cells and check that they agree
+def benchmark_batch(count, seed=0):
+    boards = get_random_boards(count, seed)
+
+    start = time.perf_counter()
+    status, score = evaluate_batch(boards)
+    batch_seconds = time.perf_counter() - start
+
+    sample = min(count, 10000)  # The scalar loop is slow, time it on part of the boards
+    cells = boards[:sample].tolist()
+    start = time.perf_counter()
+    results = [evaluate_cells(board) for board in cells]
+    scalar_seconds = time.perf_counter() - start
+
+    mismatches = sum(result != (status[i], score[i]) for i, result in enumerate(results))
+    counts = np.bincount(status.astype(np.int64) + 1, minlength=4)
+    print(f'{count} boards of {COLS}x{ROWS}: {counts[0]} ongoing, {counts[1]} won by player 1, '
+          f'{counts[2]} won by player 2, {counts[3]} tied')
+    print(f'batch  {count / batch_seconds:12.0f} boards/sec')
+    print(f'scalar {sample / scalar_seconds:12.0f} boards/sec '
+          f'({scalar_seconds / sample * count / batch_seconds:.0f}x slower), {mismatches} mismatches')
+
+
+# Get the record of a finished game: a header with the board size and the result, and one column digit per move
+# e.g. '8x8 1 34343' is a game on 8x8 that player 1 won with four tokens in column 4
+def format_record(game, result):
+    if result == 0:
+        outcome = RECORD_RESULTS[2]
+    else:
+        outcome = RECORD_RESULTS[1 - game.player]  # The player who made the last move won
+    return f'{COLS}x{ROWS} {outcome} ' + ''.join(str(col) for col in game.moves)
+
+
+# Add the record of a finished game to the record file
+def save_record(game, result, path=RECORD_PATH):
+    try:
+        with open(path, 'a') as f:
+            f.write(format_record(game, result) + '\n')
+    except OSError as error:
+        print(f'Could not save the game record: {error}')
+
+
+# Read records one at a time from a text file of records or a packed file, as (result index, list of columns)
+# The result index is the position of the result in RECORD_RESULTS; a line that is not a record gives None
+def read_records(path):
+    with open(path, 'rb') as f:
+        header = f.read(RECORD_HEADER.size)
+        if header[:len(RECORD_MAGIC)] == RECORD_MAGIC:
+            _, cols, rows = RECORD_HEADER.unpack(header)
+            if (cols, rows) != (COLS, ROWS):
+                raise ValueError(f'{path} holds games on {cols}x{rows}, not {COLS}x{ROWS}')
+            while True:
+                head = f.read(2)
+                if len(head) < 2:
+                    return
+                result, count = head
+                packed = f.read((count + 1) // 2)
+                moves = []
+                for byte in packed:
+                    moves.append(byte >> 4)
+                    moves.append(byte & 15)
+                yield result, moves[:count]
+        else:
+            f.seek(0)
+            size = f'{COLS}x{ROWS}'
+            for line in f:
+                fields = line.decode(errors='replace').split()
+                if not fields:
+                    continue
+                moves = fields[2] if len(fields) > 2 else ''
+                if (len(fields) > 3 or fields[0] != size or len(fields[1]) != 1 or fields[1] not in RECORD_RESULTS
+                        or not (moves.isascii() and moves.isdigit() or moves == '') or len(moves) > COLS*ROWS):
+                    yield None
+                    continue
+                yield RECORD_RESULTS.index(fields[1]), [int(col) for col in moves]
+
+
+# Pack records into a binary file: a header, then per game the result, the number of moves
+# and the columns in 4 bits each; returns the number of records packed and of bad ones left out
+def pack_records(records, path):
+    count = skipped = 0
+    with open(path, 'wb') as f:
+        f.write(RECORD_HEADER.pack(RECORD_MAGIC, COLS, ROWS))
+        for record in records:
+            if record is None:
+                skipped += 1
                 continue
-    # Check decreasing diagonal
-    for i in range(COLS-3):
-        for j in range(ROWS-1,2,-1):
-            try:
-                if (g_game[i][j] == player and
-                        g_game[i+1][j-1] == player and
-                        g_game[i+2][j-2] == player and
-                        g_game[i+3][j-3] == player):
-                    for k in range(4):
-                        outline(g_game_turtle[i+k][j-k], COLOR_OUTLINE, OUTLINE_WIDTH)
-                    return 1
-            except:
+            result, moves = record
+            padded = moves + [0] * (len(moves) % 2)
+            packed = bytes(padded[i] << 4 | padded[i + 1] for i in range(0, len(padded), 2))
+            f.write(bytes((result, len(moves))) + packed)
+            count += 1
+    return count, skipped
+
+
+# Replay the records through the headless engine, check them and print the outcome statistics
+# The records are streamed, so the memory use does not depend on the size of the file
+def analyze_records(path):
+    start = time.perf_counter()
+    games = invalid = moves_total = 0
+    outcomes = [0] * len(RECORD_RESULTS)
+    shortest, longest = COLS*ROWS, 0
+    for record in read_records(path):
+        games += 1
+        if record is None:
+            invalid += 1  # Not a record at all
+            continue
+        result, moves = record
+        game = Connect4()
+        outcome = -1
+        for col in moves:
+            if outcome >= 0 or not game.can_play(col):
+                break  # A move after the end of the game or on a full or missing column
+            outcome = game.play(col)
+        else:
+            if outcome == 0:
+                outcome = 2
+            elif outcome == 1:
+                outcome = 1 - game.player
+            if outcome == result:
+                outcomes[result] += 1
+                moves_total += len(moves)
+                shortest = min(shortest, len(moves))
+                longest = max(longest, len(moves))
                 continue
-    # Check for tie
-    full_cols = 0
-    for i in range(COLS):
-        if len(g_game[i]) == ROWS:
-            full_cols += 1
-    if full_cols == COLS:
-        return 0
+        invalid += 1
+
+    seconds = time.perf_counter() - start
+    valid = games - invalid
+    print(f'{games} games in {seconds:.2f}s ({games / seconds if seconds > 0 else 0:.0f} games/sec), '
+          f'{invalid} invalid')
+    if valid:
+        print(f'player 1 wins {outcomes[0] / valid:.1%}, player 2 wins {outcomes[1] / valid:.1%}, '
+              f'ties {outcomes[2] / valid:.1%}, {moves_total / valid:.1f} moves per game '
+              f'(shortest {shortest}, longest {longest})')
+    return games, invalid, outcomes
+
+
+# Search of the computer player in a background thread, so the window stays responsive
+class BackgroundSearch:
+    def __init__(self, ai, own, other, heights):
+        self.ai = ai
+        self.lock = threading.Lock()
+        self.progress = None  # (column, stats) of the deepest finished search so far
+        self.result = None  # (column, stats) once the search has finished
+        self.cancelled = False
+        self.thread = threading.Thread(target=self.run, args=(own, other, list(heights)), daemon=True)
+        self.thread.start()
+
+    def run(self, own, other, heights):
+        result = self.ai.choose_move(own, other, heights, self.on_progress)
+        with self.lock:
+            self.result = result
+
+    def on_progress(self, col, stats):
+        with self.lock:
+            self.progress = (col, stats)
+
+    # Get the (progress, result) of the search, each None if there is none yet
+    def poll(self):
+        with self.lock:
+            return self.progress, self.result
+
+    # Stop the search, its result is ignored
+    def cancel(self):
+        self.cancelled = True
+        self.ai.stop()
+
+
+# Play the computer player's turn
+def ai_turn():
+    global g_search
+    player = g_game.player
+    own, other = g_game.boards[player], g_game.boards[1 - player]
+    found = g_book.lookup(own, other) if g_book is not None else None
+    if found is not None:
+        print(f'Player {player + 1} (computer) plays column {found[0] + 1} from the opening book')
+        place_token(found[0])
+        return
+    g_search = BackgroundSearch(g_ai, own, other, g_game.heights)
+    scn.title(f'Player {player + 1} (computer) is thinking')
+    scn.ontimer(poll_search, SEARCH_POLL_RATE)
+
+
+# Check on the computer player's search from the event loop, showing its best move so far
+def poll_search():
+    global g_search
+    if g_search is None or g_search.cancelled:
+        return
+    progress, result = g_search.poll()
+    player = g_game.player
+    if result is None:
+        if progress is not None:
+            col, stats = progress
+            scn.title(f'Player {player + 1} (computer) is thinking: column {col + 1} at depth {stats["depth"]}')
+        scn.ontimer(poll_search, SEARCH_POLL_RATE)
+        return
+
+    g_search = None
+    col, stats = result
+    print(f'Player {player + 1} (computer) plays column {col + 1}: {g_ai.report(stats)}')
+    scn.title('Connect 4 Game')
+    place_token(col)
+
+
+# Stop the computer player and close the window
+def close_window():
+    if g_search is not None:
+        g_search.cancel()
+    if g_ai is not None:
+        g_ai.close()
+    scn.bye()
 
-    return -1
-    
 
 # Play the player's turn
 def play_turn(x, y):
-    global g_game, g_game_turtle, player
-    col = column_tracking()  # The column number where the mouse click was located
-    num = len(g_game[col])  # Number of tokens in that column
+    if g_game.player in g_ai_players:
+        return  # Wait for the computer to move
+    col = g_tracked[0]  # Drop into the highlighted column, the click's world x is scaled unlike the motion's pixel x
+    if col < 0:
+        return
     
     # Reject player intention to put token on full column
-    if num >= ROWS:
+    if not g_game.can_play(col):
         print('The column is full. Please choose another column.')
         return
+
+    place_token(col)
+
+
+# Put the current player's token on a column and pass the turn
+def place_token(col):
+    player = g_game.player
     
-    # Set x and y coordinate for the token final position
-    x = 30 + (60 + SPACING) * col
-    y = 70 + (60 + SPACING) * num
-    
-    # Insert the new token on the selected column with specified color
+    # Stamp the new token on the selected column with specified color
+    row = g_game.heights[col]
     if player == 0:
-        tt = new_token(x, y, COLOR_1)
+        color = COLOR_1
     else:
-        tt = new_token(x, y, COLOR_2)
-    
-    # Add current player and the turtle to list
-    g_game[col].append(player)
-    g_game_turtle[col].append(tt)
+        color = COLOR_2
+    draw_token(col, row, color)
     
     # Check if the player has won the game or the game is tied
-    result = check_game()
+    result = g_game.play(col)
+    if result >= 0:
+        save_record(g_game, result)
     if result == 0:
         # The game is tied
         scn.title('Game Tied !')
+        scn.update()
         scn.exitonclick()  # Exit the game on next click
+        return  # The screen is gone once exitonclick returns
     elif result > 0:
-        # The current player wins
+        # The current player wins, outline the four in a row
+        for c, r in g_game.winning_cells():
+            draw_token(c, r, color, COLOR_OUTLINE)
         scn.title(f'Winner ! Player {player + 1}')
+        scn.update()
         scn.exitonclick()  # Exit the game on next click
+        return  # The screen is gone once exitonclick returns
+
+    update_tracker(g_tracked[0])  # Show the tracker in the new player's color, this also refreshes the screen
 
-    player = (player + 1) % 2  # Update the player's turn
+    # Let the computer move once the new token is on screen
+    if g_game.player in g_ai_players:
+        scn.ontimer(ai_turn, 0)
 
 
 # Initialize the game
 def init_game():
+    global g_game, scn
+    g_game = Connect4()
+
     # Initialize the screen
+    scn = turtle.Screen()
     scn.mode('world')
     scn.setup(SCREEN_WIDTH, SCREEN_HEIGHT)
     scn.setworldcoordinates(0, 0, SCREEN_WIDTH, SCREEN_HEIGHT)
@@ -222,13 +1344,81 @@ def init_game():
     # Bind motion with mouse tracking
     canvas = turtle.getcanvas()
     canvas.bind('<Motion>', motion)
+    canvas.winfo_toplevel().protocol('WM_DELETE_WINDOW', close_window)  # Cancel the computer player on close
     
     init_column_trackers()  # Create the column trackers
     
-    scn.ontimer(column_tracking, REFRESH_RATE)  # Call column_tracking function every REFRESH_RATE milliseconds
+    if g_game.player in g_ai_players:
+        scn.ontimer(ai_turn, REFRESH_RATE)  # The computer makes the first move
 
     scn.mainloop()  # Keep the window on
 
 
+# Read the command line options
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Connect 4 Game')
+    parser.add_argument('--ai', type=int, nargs='+', choices=[1, 2], default=[],
+                        help='players played by the computer, e.g. --ai 2')
+    parser.add_argument('--ai-time', type=int, default=AI_TIME,
+                        help='time budget of the computer player in ms per move')
+    parser.add_argument('--engine', choices=['alphabeta', 'parallel', 'mcts'], default='alphabeta',
+                        help='search of the computer player')
+    parser.add_argument('--benchmark-parallel', type=int, metavar='DEPTH',
+                        help='measure the speedup of the parallel alpha-beta search at a fixed depth')
+    parser.add_argument('--benchmark-mcts', action='store_true',
+                        help='measure how the Monte Carlo tree search scales with the number of workers')
+    parser.add_argument('--selfplay', type=int, metavar='GAMES',
+                        help='play GAMES games between two policies without a window and print the results')
+    parser.add_argument('--policies', nargs=2, choices=sorted(POLICIES), default=['random', 'greedy'],
+                        help='the two self-play policies')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='number of self-play or computer player search worker processes')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the self-play games')
+    parser.add_argument('--benchmark-batch', type=int, metavar='BOARDS',
+                        help='compare the NumPy batch evaluation with the scalar loop on random boards')
+    parser.add_argument('--pack-records', nargs=2, metavar=('RECORDS', 'PACKED'),
+                        help='pack a file of game records into a binary file')
+    parser.add_argument('--analyze-records', metavar='FILE',
+                        help='replay and check a text or packed file of game records and print statistics')
+    parser.add_argument('--build-book', action='store_true', help=f'build the opening book {BOOK_PATH}')
+    parser.add_argument('--book-plies', type=int, default=BOOK_PLIES,
+                        help='the book holds every position with at most this many tokens')
+    parser.add_argument('--book-depth', type=int, default=BOOK_DEPTH, help='search depth of the book moves')
+    return parser.parse_args()
+
+
 if __name__ == '__main__':
+    args = parse_arguments()
+    if args.selfplay:
+        run_selfplay(args.selfplay, args.policies, args.workers, args.seed)
+        raise SystemExit
+    if args.benchmark_parallel:
+        benchmark_parallel(args.benchmark_parallel, args.workers)
+        raise SystemExit
+    if args.benchmark_mcts:
+        benchmark_mcts(args.ai_time, args.workers, args.seed)
+        raise SystemExit
+    if args.benchmark_batch:
+        benchmark_batch(args.benchmark_batch, args.seed)
+        raise SystemExit
+    if args.pack_records:
+        count, skipped = pack_records(read_records(args.pack_records[0]), args.pack_records[1])
+        print(f'Packed {count} games into {args.pack_records[1]}, left out {skipped} bad records')
+        raise SystemExit
+    if args.analyze_records:
+        analyze_records(args.analyze_records)
+        raise SystemExit
+    if args.build_book:
+        build_opening_book(BOOK_PATH, args.book_plies, args.book_depth)
+        raise SystemExit
+    g_ai_players = {p - 1 for p in args.ai}
+    if g_ai_players:
+        if args.engine == 'mcts':
+            g_ai = MCTSAI(args.ai_time, args.workers)
+        elif args.engine == 'parallel':
+            g_ai = ParallelAlphaBetaAI(args.ai_time, args.workers)
+            g_book = load_opening_book()
+        else:
+            g_ai = AlphaBetaAI(args.ai_time)
+            g_book = load_opening_book()
     init_game()